@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from wildcat_analysis import bode, characterize, filter_group_delay, make_filter
+from wildcat_driving_tester import FPS, WildCat
+
+
+@pytest.mark.parametrize('params', [WildCat.XD_FILTER, WildCat.RZD_FILTER])
+def test_filters_pass_dc(params):
+    filt = make_filter(params, 1.0 / FPS)
+    (mag_db, phase) = bode(filt, [0.0])
+    assert abs(mag_db[0]) < 1e-3
+    assert abs(phase[0]) < 1e-9
+    assert filter_group_delay(filt) > 0
+
+
+@pytest.mark.parametrize('axis, params', [('xd', WildCat.XD_FILTER), ('yd', None), ('rzd', WildCat.RZD_FILTER)])
+def test_steps_settle_on_the_request(axis, params):
+    res = characterize(axis, filter_params=params, n_freqs=100, n_amps=10, duration=20.0)
+    np.testing.assert_allclose(res['step'][-1], res['amplitudes'], atol=1e-3)
+    assert not np.isnan(res['step_metrics']['settling']).any()
+    if params:
+        assert 0 < res['bandwidth'] < 0.5 * FPS
@@ -0,0 +1,131 @@
+import math
+import random
+
+import numpy as np
+import pygame
+import pytest
+
+import wildcat_driving_tester as game
+from wildcat_driving_helpers import JOYSTICK_CFG, FixedStepClock, ScriptedJoystick
+from wildcat_telemetry import TelemetryLogger, SessionReplay, read_telemetry
+
+SEED = 7
+
+
+@pytest.fixture(scope='module', autouse=True)
+def images():
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    img = game.load_images('LS3_FLHR_small.png', 'LS3_FRHL_small.png')
+    game.LS3.images = img + [pygame.transform.flip(im, 1, 0) for im in img]
+    img = game.load_image('explosion1.gif', -1)
+    game.Explosion.images = [img, pygame.transform.flip(img, 1, 1)]
+    game.LS3.masks = game.load_masks(game.LS3.images)
+    yield
+    pygame.quit()
+
+
+def new_simulation():
+    joystick = ScriptedJoystick()
+    clock = FixedStepClock(1.0 / game.FPS)
+    sim = game.Simulation([joystick], clock)
+    sim.easter_egg = True
+    return sim
+
+
+def drive(sim, n, rewinds=()):
+    ''' Step 'sim' for 'n' frames with a scripted driver that turns, speeds up and fires. '''
+    joystick = sim.joystick
+    for i in range(n):
+        t = sim.frame / game.FPS
+        joystick.set_axis(JOYSTICK_CFG.X_AXIS, -0.8 * math.sin(t / 3))
+        joystick.set_axis(JOYSTICK_CFG.RZ_AXIS, 0.6 * math.sin(t))
+        joystick.set_button(JOYSTICK_CFG.LBUMP, int(sim.frame % 20 < 3))
+        if i in rewinds:
+            sim.rewind()
+        sim.step()
+
+
+def record(path, n, rewinds=()):
+    random.seed(SEED)
+    sim = new_simulation()
+    logger = TelemetryLogger(path, chunk_size=256, meta={'seed': SEED, 'world': None, 'robots': 1})
+    sim.telemetry.append(logger.log)
+    drive(sim, n, rewinds)
+    logger.close()
+    return sim
+
+
+def replay(path, log_path=None):
+    session = SessionReplay(path)
+    random.seed(session.meta['seed'])
+    joystick = ScriptedJoystick()
+    clock = FixedStepClock(1.0 / game.FPS)
+    sim = game.Simulation([joystick], clock)
+    logger = TelemetryLogger(log_path, meta=session.meta) if log_path else None
+    if logger:
+        sim.telemetry.append(logger.log)
+    while not session.done:
+        session.apply(sim, joystick, clock)
+        sim.step()
+    if logger:
+        logger.close()
+    return sim
+
+
+def test_replay_reproduces_the_logged_session(tmp_path):
+    path = str(tmp_path / 'session')
+    live = record(path, 600)
+    replayed = replay(path, str(tmp_path / 'replayed'))
+    assert replayed.frame == live.frame == 600
+    assert replayed.save_state() == live.save_state()
+    np.testing.assert_array_equal(read_telemetry(str(tmp_path / 'replayed')), read_telemetry(path))
+
+
+def test_replay_follows_rewinds(tmp_path):
+    path = str(tmp_path / 'session')
+    live = record(path, 600, rewinds=(100, 300, 301, 450))
+    replayed = replay(path)
+    assert replayed.frame == live.frame
+    assert replayed.save_state() == live.save_state()
+
+
+def test_replay_rejects_a_diverging_log(tmp_path):
+    path = str(tmp_path / 'session')
+    record(path, 300)
+    session = SessionReplay(path)
+    session._inputs['frame'][200:] -= 3  # A rewind to a frame without a checkpoint
+    random.seed(session.meta['seed'])
+    joystick = ScriptedJoystick()
+    clock = FixedStepClock(1.0 / game.FPS)
+    sim = game.Simulation([joystick], clock)
+    with pytest.raises(ValueError):
+        while not session.done:
+            session.apply(sim, joystick, clock)
+            sim.step()
+
+
+def test_checkpoint_round_trip():
+    random.seed(SEED)
+    sim = new_simulation()
+    drive(sim, 400)
+    state = sim.save_state()
+
+    drive(sim, 200)
+    expected = sim.save_state()
+
+    sim.load_state(state)
+    assert sim.save_state() == state
+    drive(sim, 200)
+    assert sim.save_state() == expected
+
+
+def test_rewind_goes_back_a_checkpoint():
+    random.seed(SEED)
+    sim = new_simulation()
+    drive(sim, 400)
+    sim.rewind()
+    sim.step()
+    # Back to the latest checkpoint that is at least an interval old
+    interval = game.CHECKPOINT_INTERVAL
+    assert sim.frame == (400 - interval) // interval * interval + 1
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from wildcat_driving_helpers import (RzdSteering, VecRzdSteering, VecXdSteering, VecYdSteering, XdSteering,
+                                     YdSteering)
+from wildcat_driving_tester import FPS, WildCat
+
+DT = 1.0 / FPS
+
+
+@pytest.mark.parametrize('scalar_cls, vec_cls, limits, filt', [
+    (XdSteering, VecXdSteering, WildCat.XD_LIMITS, WildCat.XD_FILTER),
+    (YdSteering, VecYdSteering, WildCat.YD_LIMITS, None),
+    (RzdSteering, VecRzdSteering, WildCat.RZD_LIMITS, WildCat.RZD_FILTER),
+])
+def test_vectorized_steering_matches_scalar(scalar_cls, vec_cls, limits, filt):
+    rng = np.random.default_rng(0)
+    n = 8
+    requests = np.repeat(rng.uniform(-12.0, 12.0, (40, n)), 10, axis=0)  # Held for 10 frames each
+    speeds = rng.uniform(-3.0, 9.5, n)
+
+    scalars = [scalar_cls(*limits) for _ in range(n)]
+    vec = vec_cls(n, *limits)
+    if filt:
+        for s in scalars:
+            s.set_filter_params(DT, *filt)
+        vec.set_filter_params(DT, *filt)
+    for s in scalars:
+        s.reset(0.0)
+    vec.reset(0.0)
+
+    for req in requests:
+        if vec_cls is VecRzdSteering:
+            vec.update(req, speeds, DT)
+            expected = [s.update(r, v, DT) for (s, r, v) in zip(scalars, req, speeds)]
+        else:
+            vec.update(req, DT)
+            expected = [s.update(r, DT) for (s, r) in zip(scalars, req)]
+        np.testing.assert_allclose(vec.cmd_d_unfilt, [s.cmd_d_unfilt for s in scalars], rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(vec.cmd_d, expected, rtol=1e-9, atol=1e-12)
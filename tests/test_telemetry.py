@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from wildcat_telemetry import (TELEMETRY_DTYPE, TelemetryLogger, TelemetryRing, open_telemetry,
+                               read_telemetry, read_telemetry_meta)
+
+
+def make_rows(frames):
+    rows = np.zeros(len(frames), TELEMETRY_DTYPE)
+    rows['frame'] = frames
+    rows['x'] = np.asarray(frames) * 0.5
+    return rows
+
+
+def test_ring_wraps_around():
+    ring = TelemetryRing(capacity=8)
+    try:
+        for row in make_rows(range(5)):
+            ring.push(row)
+        (records, last) = ring.read_since(0)
+        assert list(records['frame']) == [0, 1, 2, 3, 4]
+        assert last == 5
+
+        for row in make_rows(range(5, 30)):
+            ring.push(row)
+        (records, last) = ring.read_since(last)
+        # The oldest records were overwritten, and the one in the next slot to be written
+        # may be torn, so only the newest capacity - 1 are returned
+        assert list(records['frame']) == list(range(23, 30))
+        assert list(records['x']) == [f * 0.5 for f in range(23, 30)]
+        assert last == 30
+
+        (records, last) = ring.read_since(last)
+        assert len(records) == 0 and last == 30
+    finally:
+        ring.close()
+
+
+def test_logger_round_trip(tmp_path):
+    path = str(tmp_path / 'session')
+    rows = make_rows(range(50))
+    logger = TelemetryLogger(path, chunk_size=16, meta={'seed': 3})
+    for row in rows:
+        logger.log(row)
+    logger.close()
+
+    assert len(open_telemetry(path)) == 4
+    np.testing.assert_array_equal(read_telemetry(path), rows)
+    np.testing.assert_array_equal(read_telemetry(path, ['frame'])['frame'], rows['frame'])
+    assert read_telemetry_meta(path)['seed'] == 3
+
+    # A directory holds a single session
+    with pytest.raises(FileExistsError):
+        TelemetryLogger(path)
+
+
+def test_logger_raises_write_errors(tmp_path):
+    path = str(tmp_path / 'session')
+    logger = TelemetryLogger(path, chunk_size=4)
+    os.remove(os.path.join(path, 'meta.json'))
+    os.rmdir(path)
+    for row in make_rows(range(4)):
+        logger.log(row)
+    with pytest.raises(OSError):
+        logger.close()
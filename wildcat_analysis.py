@@ -0,0 +1,199 @@
+'''
+Frequency and time response analysis of the WildCat steering chain.
+
+For each steering axis this computes, with NumPy over whole arrays at once:
+
+    - the Bode magnitude and phase of its Filter2ndOrder over a dense frequency grid,
+      evaluated from the filter's discrete transfer function H(z) = B(z) / A(z)
+    - the -3 dB bandwidth and group delay of the filter
+    - step and ramp responses of the full saturate -> slew limit -> filter chain for many
+      amplitudes at once, using the vectorized steering processors
+
+Filters can be overridden to try out new settings before changing the WildCat:
+
+    python wildcat_analysis.py
+    python wildcat_analysis.py --xd-filter 1.2 0.6 --rzd-filter 2.5 0.7
+'''
+import argparse
+import math
+import time
+
+import numpy as np
+
+from wildcat_driving_helpers import *
+from wildcat_driving_tester import WildCat, FPS
+
+
+AXES = ('xd', 'yd', 'rzd')
+# The WildCat's steering limits and filter settings (cutoff frequency, quality) per axis
+LIMITS = {'xd': WildCat.XD_LIMITS, 'yd': WildCat.YD_LIMITS, 'rzd': WildCat.RZD_LIMITS}
+FILTERS = {'xd': WildCat.XD_FILTER, 'yd': None, 'rzd': WildCat.RZD_FILTER}
+STEERING = {'xd': VecXdSteering, 'yd': VecYdSteering, 'rzd': VecRzdSteering}
+
+
+def filter_response(filt, freqs):
+    ''' The complex frequency response of a Filter2ndOrder at 'freqs' (Hz). '''
+    z = np.exp(2j * math.pi * np.asarray(freqs) * filt.dt)
+    return np.polyval(filt.B.coeffs, z) / np.polyval(filt.A.coeffs, z)
+
+
+def bode(filt, freqs):
+    ''' Magnitude (dB) and unwrapped phase (degrees) of a Filter2ndOrder at 'freqs' (Hz). '''
+    h = filter_response(filt, freqs)
+    return (20 * np.log10(np.abs(h)), np.degrees(np.unwrap(np.angle(h))))
+
+
+def filter_group_delay(filt, freqs=0.0):
+    '''
+    Group delay (in seconds) of a Filter2ndOrder at 'freqs' (Hz), computed from its
+    discrete transfer function H(z) = B(z) / A(z).
+
+    With z = exp(jw), d(arg P(z))/dw = Re(z P'(z) / P(z)) for any polynomial P, so the
+    group delay in samples is Re(z A'/A) - Re(z B'/B).
+    '''
+    z = np.exp(2j * math.pi * np.asarray(freqs) * filt.dt)
+    a = filt.A
+    b = filt.B
+    tau_a = (z * a.deriv()(z) / a(z)).real
+    tau_b = (z * b.deriv()(z) / b(z)).real
+    return (tau_a - tau_b) * filt.dt
+
+
+def bandwidth(freqs, mag_db):
+    ''' The first frequency at which the magnitude has fallen 3 dB, or None. '''
+    below = mag_db <= -3.0
+    return freqs[np.argmax(below)] if below.any() else None
+
+
+def make_filter(params, dt):
+    (fc, q) = params
+    return Filter2ndOrder(dt, fc, 1, q)
+
+
+def make_steering(axis, n, dt, filter_params=None):
+    ''' A vectorized steering processor for 'n' robots, set up like the WildCat's. '''
+    steering = STEERING[axis](n, *LIMITS[axis])
+    if filter_params:
+        steering.set_filter_params(dt, *filter_params)
+    steering.reset(0.0)
+    return steering
+
+
+def simulate(steering, requests, dt, xd_d=0.0):
+    '''
+    Run the steering chain on 'requests', an (n_steps, n) array of requested commands.
+    Returns the unfiltered and filtered commands, each (n_steps, n).  'xd_d' is the
+    forward speed used to limit rzd.
+    '''
+    unfilt = np.empty(requests.shape)
+    out = np.empty(requests.shape)
+    xd_d = np.full(requests.shape[1], xd_d)
+    for k, req in enumerate(requests):
+        if isinstance(steering, VecRzdSteering):
+            steering.update(req, xd_d, dt)
+        else:
+            steering.update(req, dt)
+        unfilt[k] = steering.cmd_d_unfilt
+        out[k] = steering.cmd_d
+    return (unfilt, out)
+
+
+def step_metrics(t, response, target, settle=0.02):
+    '''
+    Rise time (10-90%), overshoot (fraction of the target) and settling time (within
+    'settle' of the target) of each column of 'response'.  NaN where never reached.
+    '''
+    frac = response / target
+    reached_10 = frac >= 0.1
+    reached_90 = frac >= 0.9
+    rise = np.where(reached_90.any(axis=0), t[np.argmax(reached_90, axis=0)] - t[np.argmax(reached_10, axis=0)], np.nan)
+    overshoot = np.maximum(frac.max(axis=0) - 1.0, 0.0)
+    outside = np.abs(frac - 1.0) > settle
+    last = len(t) - 1 - np.argmax(outside[::-1], axis=0)
+    settling = np.where(outside[-1], np.nan, np.where(outside.any(axis=0), t[np.minimum(last + 1, len(t) - 1)], 0.0))
+    return {'rise': rise, 'overshoot': overshoot, 'settling': settling}
+
+
+def characterize(axis, dt=1.0 / FPS, filter_params=None, n_freqs=2000, n_amps=200, duration=10.0, xd_d=0.0):
+    '''
+    The frequency response of the axis' filter and its step and ramp responses for
+    'n_amps' amplitudes spanning the axis' limits.  Returns a dict of arrays.
+    '''
+    out = {'axis': axis, 'dt': dt}
+
+    if filter_params:
+        filt = make_filter(filter_params, dt)
+        freqs = np.linspace(0.0, 0.5 / dt, n_freqs, endpoint=False)
+        (mag_db, phase) = bode(filt, freqs)
+        out.update(freqs=freqs, mag_db=mag_db, phase=phase, bandwidth=bandwidth(freqs, mag_db),
+                   group_delay=filter_group_delay(filt, freqs))
+
+    (cmd_min, cmd_max, slew_limit) = LIMITS[axis][:3]
+    t = np.arange(int(round(duration / dt))) * dt
+    amps = np.linspace(cmd_min, cmd_max, n_amps)
+    amps = amps[amps != 0]
+    steering = make_steering(axis, len(amps), dt, filter_params)
+    requests = np.broadcast_to(amps, (len(t), len(amps)))
+    (unfilt, step) = simulate(steering, requests, dt, xd_d)
+    out.update(t=t, amplitudes=amps, step_unfilt=unfilt, step=step,
+               step_metrics=step_metrics(t, step, steering.cmd_req))
+
+    # Ramps from a tenth of the slew limit to twice it, up to the axis' maximum
+    rates = np.linspace(0.1, 2.0, n_amps) * slew_limit
+    steering = make_steering(axis, len(rates), dt, filter_params)
+    ramp_req = np.minimum(np.outer(t, rates), cmd_max)
+    (_, ramp) = simulate(steering, ramp_req, dt, xd_d)
+    # Tracking lag (s) just before the request saturates, or at the end of the run
+    last = np.minimum(np.argmax(ramp_req >= cmd_max, axis=0) - 1, len(t) - 1)
+    last = np.where((ramp_req >= cmd_max).any(axis=0), last, len(t) - 1)
+    cols = np.arange(len(rates))
+    out.update(ramp_rates=rates, ramp=ramp, ramp_lag=(ramp_req[last, cols] - ramp[last, cols]) / rates)
+    return out
+
+
+def print_characterization(res):
+    axis = res['axis']
+    print("%s" % axis)
+    if 'freqs' in res:
+        bw = res['bandwidth']
+        print("  filter -3 dB bandwidth  %s" % ("%.2f Hz" % bw if bw is not None else "above Nyquist"))
+        print("  filter group delay      %.1f ms at DC, %.1f ms max" %
+              (1000.0 * res['group_delay'][0], 1000.0 * res['group_delay'].max()))
+    else:
+        print("  no filter")
+
+    m = res['step_metrics']
+    amps = res['amplitudes']
+    print("  %10s %10s %10s %10s" % ("step", "rise ms", "overshoot", "settle ms"))
+    for i in np.unique(np.linspace(0, len(amps) - 1, 5).astype(int)):
+        print("  %10.2f %10.0f %9.1f%% %10.0f" % (amps[i], 1000.0 * m['rise'][i], 100.0 * m['overshoot'][i],
+                                                 1000.0 * m['settling'][i]))
+    rates = res['ramp_rates']
+    print("  %10s %10s" % ("ramp /s", "lag ms"))
+    for i in np.unique(np.linspace(0, len(rates) - 1, 5).astype(int)):
+        print("  %10.2f %10.0f" % (rates[i], 1000.0 * res['ramp_lag'][i]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Characterize the WildCat steering chain.")
+    for axis in ('xd', 'rzd'):
+        parser.add_argument('--%s-filter' % axis, type=float, nargs=2, metavar=('FC', 'Q'),
+                            default=FILTERS[axis], help="%s filter cutoff (Hz) and quality" % axis)
+    parser.add_argument('--freqs', type=int, default=2000, help="number of frequencies in the Bode plots")
+    parser.add_argument('--amplitudes', type=int, default=200, help="number of step and ramp amplitudes")
+    parser.add_argument('--duration', type=float, default=10.0, help="length of the responses (s)")
+    parser.add_argument('--speed', type=float, default=0.0, help="forward speed (m/s) for the rzd responses")
+    args = parser.parse_args()
+
+    filters = {'xd': args.xd_filter, 'yd': None, 'rzd': args.rzd_filter}
+    start = time.perf_counter()
+    results = [characterize(axis, filter_params=filters[axis], n_freqs=args.freqs, n_amps=args.amplitudes,
+                            duration=args.duration, xd_d=args.speed) for axis in AXES]
+    elapsed = time.perf_counter() - start
+
+    for res in results:
+        print_characterization(res)
+    print("\nCharacterized %d axes in %.0f ms" % (len(AXES), 1000.0 * elapsed))
+
+
+if __name__ == '__main__': main()
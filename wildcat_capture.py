@@ -0,0 +1,191 @@
+'''
+Frame capture for the WildCat driving simulator.
+
+A FrameRecorder copies the raw pixels of every rendered frame into a ring of preallocated
+frame slots in shared memory and a worker process converts and writes the frames out, so
+the game only pays for one copy of the screen per frame.  Frames are written as a video
+through ffmpeg when the output path has a video extension, and as numbered PNG files in a
+directory otherwise:
+
+    python wildcat_driving_tester.py --capture demo.mp4
+    python wildcat_driving_tester.py --replay runs/session1 --headless --capture frames/
+'''
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from wildcat_telemetry import attach_shared_memory
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+POLL_INTERVAL = 1.0  # s, how often a waiting game or worker checks that the other is still running
+
+
+class FrameRecorder:
+    '''
+    Captures frames of the size and pixel format of 'surface', a 32 bit surface, into
+    'n_slots' shared frame buffers that are drained by a worker process.  'capture' only
+    blocks when the worker is 'n_slots' frames behind, and raises a RuntimeError if the
+    worker has died.  Always 'close' the recorder, or the worker outlives the game.
+    '''
+    def __init__(self, path, surface, fps, n_slots=8):
+        (width, height) = surface.get_size()
+        if surface.get_bytesize() != 4:
+            raise ValueError("Only 32 bit surfaces can be captured.")
+        if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS and shutil.which('ffmpeg') is None:
+            raise RuntimeError("Capturing to '%s' needs ffmpeg, which wasn't found." % path)
+
+        self._format = (surface.get_size(), surface.get_masks())
+        self._n_slots = n_slots
+        # Frames are stored as rows of the surface's own pixels, (height, width, 4 bytes),
+        # and the worker picks the red, green and blue bytes out of them.
+        self._shape = (n_slots, height, width, 4)
+        shifts = surface.get_shifts()[:3]
+        channels = [s // 8 if sys.byteorder == 'little' else 3 - s // 8 for s in shifts]
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self._shape)))
+        self._frames = np.ndarray(self._shape, np.uint8, buffer=self._shm.buf)
+        self._count = 0
+
+        ctx = multiprocessing.get_context('spawn')
+        self._free = ctx.Semaphore(n_slots)
+        self._filled = ctx.Semaphore(0)
+        self._total = ctx.Value('q', -1)  # Number of frames captured, set once capturing ends
+        self._worker = ctx.Process(target=_write_frames, name='FrameWriter',
+                                   args=(self._shm.name, self._shape, channels, path, fps,
+                                         self._free, self._filled, self._total))
+        self._worker.start()
+
+    @property
+    def count(self):
+        return self._count
+
+    def capture(self, surface):
+        if (surface.get_size(), surface.get_masks()) != self._format:
+            raise ValueError("Expected a %dx%d surface with the pixel format the recorder was made for." %
+                             self._format[0])
+        while not self._free.acquire(timeout=POLL_INTERVAL):
+            self._check_worker()
+        # A plain copy of the pixel rows, which is much faster than converting them here
+        (_, height, width, _) = self._shape
+        rows = np.frombuffer(surface.get_buffer(), np.uint8).reshape(height, surface.get_pitch())
+        self._frames[self._count % self._n_slots] = rows[:, :width * 4].reshape(height, width, 4)
+        del rows  # Unlocks the surface
+        self._count += 1
+        self._filled.release()
+
+    def close(self, timeout=60.0):
+        '''
+        Wait up to 'timeout' seconds for the worker to write out every captured frame, and
+        stop it if it takes longer.
+        '''
+        self._total.value = self._count
+        self._filled.release()  # Wake the worker in case it is waiting for a frame
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            self._worker.terminate()
+            self._worker.join()
+        self._frames = None
+        self._shm.close()
+        self._shm.unlink()
+        if self._worker.exitcode:
+            raise RuntimeError("The frame writer stopped with exit code %d; the capture is incomplete." %
+                               self._worker.exitcode)
+
+    def _check_worker(self):
+        if not self._worker.is_alive():
+            raise RuntimeError("The frame writer stopped with exit code %s." % self._worker.exitcode)
+
+
+def _write_frames(name, shape, channels, path, fps, free, filled, total):
+    shm = attach_shared_memory(name)
+    frames = np.ndarray(shape, np.uint8, buffer=shm.buf)
+    (n_slots, height, width, _) = shape
+
+    if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+        writer = _FFmpegWriter(path, width, height, fps)
+    else:
+        writer = _PngWriter(path)
+
+    rgb = np.empty((height, width, 3), np.uint8)
+    count = 0
+    while True:
+        if not filled.acquire(timeout=POLL_INTERVAL):
+            if not multiprocessing.parent_process().is_alive():
+                break  # The game died without closing the recorder
+            continue
+        if count == total.value:
+            # Every captured frame has been written; this was the wake-up from close()
+            break
+        # Pick the red, green and blue bytes out of the raw pixels; a channel at a time is
+        # several times faster than fancy indexing.
+        frame = frames[count % n_slots]
+        for (i, c) in enumerate(channels):
+            rgb[..., i] = frame[..., c]
+        writer.write(rgb)
+        count += 1
+        free.release()
+
+    writer.close()
+    frames = None
+    shm.close()
+
+
+class _FFmpegWriter:
+    def __init__(self, path, width, height, fps):
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(fps),
+               '-i', '-', '-pix_fmt', 'yuv420p', path]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self._proc.stdin.write(frame.data)
+
+    def close(self):
+        self._proc.stdin.close()
+        self._proc.wait()
+
+
+PNG_COMPRESSION = 1  # zlib level of the captured PNGs; higher levels are several times slower
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+
+def encode_png(frame, level=PNG_COMPRESSION):
+    '''
+    Encode 'frame', a (height, width, 3) array of RGB pixels, as a PNG.  Every row uses
+    the 'up' filter, which is a single array subtraction and compresses the flat areas of
+    the game well, so fast compression levels are enough.
+    '''
+    (height, width, _) = frame.shape
+    rows = frame.reshape(height, width * 3)
+    raw = np.empty((height, width * 3 + 1), np.uint8)
+    raw[:, 0] = 2  # The 'up' filter: each byte minus the one above it
+    raw[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=raw[1:, 1:])
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)  # 8 bit RGB
+    return b''.join((b'\x89PNG\r\n\x1a\n', _png_chunk(b'IHDR', header),
+                     _png_chunk(b'IDAT', zlib.compress(raw.data, level)), _png_chunk(b'IEND', b'')))
+
+
+class _PngWriter:
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._count = 0
+
+    def write(self, frame):
+        with open(os.path.join(self._path, 'frame_%06d.png' % self._count), 'wb') as f:
+            f.write(encode_png(frame))
+        self._count += 1
+
+    def close(self):
+        pass
@@ -23,7 +23,24 @@ _JOYSTICK_CFG = {
 
 JOYSTICK_CFG = _JOYSTICK_CFG[platform.system()]
 
+
+# The limits shared by the steering processors below and their vectorized counterparts.
+# Both take floats or arrays.
+def xd_slew_rate(xd_d_unfilt, slew_limit, min_slew_limit, min_slew_vel):
+    ''' The slew limit of xd_d, which drops with speed down to min_slew_limit at min_slew_vel. '''
+    derate_factor = max(0.0, -(min_slew_limit - slew_limit) / min_slew_vel) if min_slew_vel > 0 else 0.0
+    return np.maximum(min_slew_limit, slew_limit - np.abs(xd_d_unfilt) * derate_factor)
+
+
+def rzd_limit(xd_d, rzd_max, rx_limit):
+    ''' The limit of rzd at the speed xd_d, where turning any faster would roll past rx_limit. '''
+    speed = np.maximum(np.abs(xd_d), 0.25)  # Avoids dividing by zero; masked out below
+    return np.where(np.abs(xd_d) < 0.25, rzd_max, (9.81 / speed) * math.tan(rx_limit))
+
+
 class SteeringProcessor:
+    __slots__ = ('_min', '_max', '_slew_limit', '_cmd_req', '_cmd_d_unfilt', '_cmd_d')
+
     def __init__(self, cmd_min, cmd_max, cmd_slew_limit):
         self._min = cmd_min
         self._max = cmd_max
@@ -63,8 +80,16 @@ class SteeringProcessor:
     def reset(self, val):
         self._cmd_req = self._cmd_d_unfilt = self._cmd_d = val
 
+    def get_state(self):
+        return (self._cmd_req, self._cmd_d_unfilt, self._cmd_d)
+
+    def set_state(self, state):
+        (self._cmd_req, self._cmd_d_unfilt, self._cmd_d) = state[:3]
+
 
 class XdSteering(SteeringProcessor):
+    __slots__ = ('_min_slew_limit', '_min_slew_vel', '_xd_filter')
+
     def __init__(self, xd_min, xd_max, xd_slew_limit, min_slew_limit, min_slew_vel):
         SteeringProcessor.__init__(self, xd_min, xd_max, xd_slew_limit)
 
@@ -74,10 +99,8 @@ class XdSteering(SteeringProcessor):
 
     def update(self, xd_req, dt):
         self._cmd_req    = self.saturate(xd_req)
-        derate_factor = max(0.0, -(self._min_slew_limit - self.slew_limit) / self._min_slew_vel) \
-            if self._min_slew_vel > 0 else 0.0
-        xd_slew_rate = max(self._min_slew_limit, self.slew_limit - abs(self._cmd_d_unfilt) * derate_factor)
-        self._cmd_d_unfilt = slew_rate_limit(self.cmd_d_unfilt, self.cmd_req, xd_slew_rate, dt)
+        slew_rate = float(xd_slew_rate(self._cmd_d_unfilt, self.slew_limit, self._min_slew_limit, self._min_slew_vel))
+        self._cmd_d_unfilt = slew_rate_limit(self.cmd_d_unfilt, self.cmd_req, slew_rate, dt)
         if self._xd_filter:
             self._cmd_d = self._xd_filter.filter_val(self.cmd_d_unfilt)
         else:
@@ -90,8 +113,20 @@ class XdSteering(SteeringProcessor):
         else:
             self._xd_filter = Filter2ndOrder(dt, fc)
 
+    def get_state(self):
+        # The commands, followed by the filter state (see Filter2ndOrder.get_state)
+        filt = self._xd_filter.get_state() if self._xd_filter else (0, 0.0, 0.0)
+        return SteeringProcessor.get_state(self) + filt
+
+    def set_state(self, state):
+        SteeringProcessor.set_state(self, state)
+        if self._xd_filter:
+            self._xd_filter.set_state(state[3:])
+
 
 class YdSteering(SteeringProcessor):
+    __slots__ = ()
+
     def __init__(self, yd_min, yd_max, yd_slew_limit):
         SteeringProcessor.__init__(self, yd_min, yd_max, yd_slew_limit)
         '''pass'''
@@ -104,6 +139,8 @@ class YdSteering(SteeringProcessor):
 
 
 class RzdSteering(SteeringProcessor):
+    __slots__ = ('_rx_limit', '_rzd_filter')
+
     def __init__(self, rzd_min, rzd_max, rzd_slew_limit, rx_max):
         SteeringProcessor.__init__(self, rzd_min, rzd_max, rzd_slew_limit)
         # This class is a bit weird in the sense that it uses the roll limits for some
@@ -114,7 +151,7 @@ class RzdSteering(SteeringProcessor):
         self._rzd_filter = None  # A filter for the slew rate limited rzd_req
 
     def update(self, rzd_req, xd_d, dt):
-        rzd_max = self.max if abs(xd_d) < 0.25 else (9.81 / abs(xd_d)) * math.tan(self._rx_limit)
+        rzd_max = float(rzd_limit(xd_d, self.max, self._rx_limit))
         self._cmd_req = self.saturate(rzd_req)
         rzd_req       = saturate(self.cmd_req, -rzd_max, rzd_max)
 
@@ -131,3 +168,195 @@ class RzdSteering(SteeringProcessor):
             self._rzd_filter = Filter2ndOrder(dt, fc, 1, q)
         else:
             self._rzd_filter = Filter2ndOrder(dt, fc)
+
+    def get_state(self):
+        # The commands, followed by the filter state (see Filter2ndOrder.get_state)
+        filt = self._rzd_filter.get_state() if self._rzd_filter else (0, 0.0, 0.0)
+        return SteeringProcessor.get_state(self) + filt
+
+    def set_state(self, state):
+        SteeringProcessor.set_state(self, state)
+        if self._rzd_filter:
+            self._rzd_filter.set_state(state[3:])
+
+
+class VecSteeringProcessor:
+    '''
+    The vectorized counterpart of SteeringProcessor, holding the steering state of 'n'
+    independent robots in NumPy arrays.
+    '''
+    def __init__(self, n, cmd_min, cmd_max, cmd_slew_limit):
+        self._min = cmd_min
+        self._max = cmd_max
+        self._slew_limit = cmd_slew_limit
+
+        self._cmd_req      = np.zeros(n)
+        self._cmd_d_unfilt = np.zeros(n)
+        self._cmd_d        = np.zeros(n)
+        self._filter       = None
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def slew_limit(self):
+        return self._slew_limit
+
+    def saturate(self, val):
+        return np.clip(val, self._min, self._max)
+
+    @property
+    def cmd_req(self):
+        return self._cmd_req
+
+    @property
+    def cmd_d_unfilt(self):
+        return self._cmd_d_unfilt
+
+    @property
+    def cmd_d(self):
+        return self._cmd_d
+
+    def reset(self, val, mask=Ellipsis):
+        self._cmd_req[mask] = self._cmd_d_unfilt[mask] = self._cmd_d[mask] = val
+        if self._filter:
+            self._filter.reset(mask)
+
+    def set_filter_params(self, dt, fc, q=None):
+        filt = Filter2ndOrder(dt, fc, 1, q) if q else Filter2ndOrder(dt, fc)
+        self._filter = VecFilter2ndOrder(filt, self._cmd_d.shape)
+
+    def _filter_output(self):
+        if self._filter:
+            self._cmd_d = self._filter.filter_val(self._cmd_d_unfilt)
+        else:
+            self._cmd_d = self._cmd_d_unfilt.copy()
+
+
+class VecXdSteering(VecSteeringProcessor):
+    def __init__(self, n, xd_min, xd_max, xd_slew_limit, min_slew_limit, min_slew_vel):
+        VecSteeringProcessor.__init__(self, n, xd_min, xd_max, xd_slew_limit)
+
+        self._min_slew_limit = min_slew_limit  # The minimum slew limit for xd_d
+        self._min_slew_vel   = min_slew_vel    # The velocity at which min slew limit occurs
+
+    def update(self, xd_req, dt):
+        self._cmd_req = self.saturate(xd_req)
+        slew_rate = xd_slew_rate(self._cmd_d_unfilt, self.slew_limit, self._min_slew_limit, self._min_slew_vel)
+        self._cmd_d_unfilt = vec_slew_rate_limit(self._cmd_d_unfilt, self._cmd_req, slew_rate, dt)
+        self._filter_output()
+        return self._cmd_d
+
+
+class VecYdSteering(VecSteeringProcessor):
+    def update(self, yd_req, dt):
+        self._cmd_req = self.saturate(yd_req)
+        self._cmd_d_unfilt = vec_slew_rate_limit(self._cmd_d_unfilt, self._cmd_req, self.slew_limit, dt)
+        self._filter_output()
+        return self._cmd_d
+
+
+class VecRzdSteering(VecSteeringProcessor):
+    def __init__(self, n, rzd_min, rzd_max, rzd_slew_limit, rx_max):
+        VecSteeringProcessor.__init__(self, n, rzd_min, rzd_max, rzd_slew_limit)
+        # See RzdSteering and rzd_limit: the roll limit also limits the turning rate at speed.
+        self._rx_limit = rx_max
+
+    def update(self, rzd_req, xd_d, dt):
+        rzd_max = rzd_limit(xd_d, self.max, self._rx_limit)
+        self._cmd_req = self.saturate(rzd_req)
+        rzd_req       = np.clip(self._cmd_req, -rzd_max, rzd_max)
+
+        self._cmd_d_unfilt = vec_slew_rate_limit(self._cmd_d_unfilt, rzd_req, self.slew_limit, dt)
+        self._filter_output()
+        return self._cmd_d
+
+
+class ScriptedJoystick:
+    '''
+    Stand-in for pygame.joystick.Joystick whose axes and buttons are set from code rather
+    than read from hardware.  Useful for test harnesses and for running without a joystick.
+    '''
+    N_AXES = 6
+    N_BUTTONS = 12
+
+    def __init__(self, name="Scripted joystick"):
+        self._name = name
+        self._initialized = False
+        self._axes = [0.0] * self.N_AXES
+        self._buttons = [0] * self.N_BUTTONS
+
+    def init(self):
+        self._initialized = True
+
+    def quit(self):
+        self._initialized = False
+
+    def get_init(self):
+        return self._initialized
+
+    def get_id(self):
+        return 0
+
+    def get_name(self):
+        return self._name
+
+    def get_numaxes(self):
+        return self.N_AXES
+
+    def get_axis(self, axis):
+        return self._axes[axis]
+
+    def set_axis(self, axis, val):
+        self._axes[axis] = saturate(val, -1.0, 1.0)
+
+    def get_numbuttons(self):
+        return self.N_BUTTONS
+
+    def get_button(self, button):
+        return self._buttons[button]
+
+    def set_button(self, button, val):
+        self._buttons[button] = int(bool(val))
+
+    def get_numhats(self):
+        return 0
+
+    def copy_from(self, joystick):
+        # Copy the current axes and buttons of another joystick
+        for i in range(min(self.N_AXES, joystick.get_numaxes())):
+            self._axes[i] = joystick.get_axis(i)
+        for i in range(min(self.N_BUTTONS, joystick.get_numbuttons())):
+            self._buttons[i] = joystick.get_button(i)
+
+
+class FixedStepClock:
+    '''
+    Stand-in for pygame.time.Clock that always reports the same frame time, so that the
+    simulation advances by exactly 'dt' seconds per tick no matter how fast it really runs.
+    '''
+    def __init__(self, dt):
+        if dt <= 0:
+            raise ValueError("Value of 'dt' must be greater than 0.")
+        self._time_ms = dt * 1000.0
+
+    def tick(self, framerate=0):
+        return self._time_ms
+
+    def set_time(self, time_ms):
+        # Change the frame time, e.g. to play back the frame times of a recorded session
+        self._time_ms = time_ms
+
+    def get_time(self):
+        return self._time_ms
+
+    def get_rawtime(self):
+        return self._time_ms
+
+    def get_fps(self):
+        return 1000.0 / self._time_ms
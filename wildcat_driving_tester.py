@@ -1,12 +1,19 @@
+import argparse
+import contextlib
 import random
 import os.path
 import copy
-from collections import deque
+import struct
+import threading
+import time
+from collections import deque, namedtuple, OrderedDict
 import platform
 
 import pygame
 
 from wildcat_driving_helpers import *
+from wildcat_telemetry import TelemetryRing, TelemetryLogger, SessionReplay, start_plotter, telemetry_row
+from wildcat_capture import FrameRecorder
 
 
 
@@ -27,15 +34,34 @@ SCREEN_WIDTH = 1080
 SCREEN_HEIGHT = 720
 GRID_SPACING = int(5.0 * PIXELS_PER_METER)
 
+# The world defaults to the size of the screen; see set_world_size()
+WORLDRECT = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
 FPS = 60.0
 
 MIN_LASER_AGE = 1 / 6.0
-MAX_SHOTS = 10
+MAX_SHOTS = 10  # Lasers in flight per robot
+ROBOT_SPACING = 4.0  # m, distance between the robots when they start
 
 LS3_ODDS   = 22            # Chances a new LS3 appears
 LS3_RELOAD = int(2 * FPS)  # Frames between new LS3s
 
+TILE_SIZE = 512       # px, size of the pre-rendered background tiles
+# Background tiles kept in the cache: enough to cover the view with a ring around it
+MAX_TILES = (-(-SCREEN_WIDTH // TILE_SIZE) + 2) * (-(-SCREEN_HEIGHT // TILE_SIZE) + 2)
+NEAR_MARGIN = 200     # px, LS3s this close to the view are updated every frame
+FAR_UPDATE_DIV = 8    # LS3s further away are updated every FAR_UPDATE_DIV frames, by all of them
+
+CHECKPOINT_INTERVAL = int(FPS)  # Frames between checkpoints of the simulation
+MAX_CHECKPOINTS = 120           # Checkpoints kept for rewinding
+
+# Replay speeds, in steps per drawn frame.  None runs as many steps as fit in TURBO_BUDGET
+# of each frame.
+TURBO_SPEEDS = (1, 2, 8, None)
+TURBO_BUDGET = 0.75 / FPS  # s
+
 GRAPH_COLORS = (blue, red, dkgreen, purple)
+ROBOT_COLORS = (blue, red, dkgreen, purple, brown)  # Outline colors of each driver's robot
 
 main_dir = os.path.split(os.path.abspath(__file__))[0]
 
@@ -55,6 +81,11 @@ def load_image(filename, colorkey=None):
     return image
 
 
+def random_steps(n):
+    # The sum of 'n' random steps of -1 or +1
+    return 2 * bin(random.getrandbits(n)).count('1') - n
+
+
 def load_images(*files):
     imgs = []
     for file in files:
@@ -62,30 +93,66 @@ def load_images(*files):
     return imgs
 
 
+def load_masks(images):
+    # Collision masks of the (colorkeyed) images, looked up by image
+    return {image: pygame.mask.from_surface(image) for image in images}
+
+
 def draw_background(screen):
     # Function to draw the background
     # Set the screen background
     screen.fill(white)
 
 
-def draw_grid(screen):
-    y_off = SCREEN_HEIGHT % GRID_SPACING
-    for y in range(0, SCREEN_HEIGHT + GRID_SPACING, GRID_SPACING):
-        pygame.draw.line(screen, dkgreen, [0, y - y_off], [SCREEN_WIDTH, y - y_off], 1)
-    x_off = SCREEN_WIDTH % GRID_SPACING
-    for x in range(0, SCREEN_WIDTH + GRID_SPACING, GRID_SPACING):
-        pygame.draw.line(screen, dkgreen, [x - x_off, 0], [x - x_off, SCREEN_HEIGHT], 1)
-
-
-def draw_border(screen):
+def draw_grid(screen, origin=(0, 0), size=(SCREEN_WIDTH, SCREEN_HEIGHT)):
+    # Draw the grid for a world of 'size' px, where the top left corner of 'screen'
+    # is at world position 'origin'.  Only the lines crossing 'screen' are drawn.
+    (ox, oy) = origin
+    (width, height) = size
+    y_off = height % GRID_SPACING
+    y_first = max(0, (oy + y_off) // GRID_SPACING)
+    y_last = min(height // GRID_SPACING + 1, (oy + screen.get_height() + y_off) // GRID_SPACING)
+    for y in range(y_first * GRID_SPACING, (y_last + 1) * GRID_SPACING, GRID_SPACING):
+        pygame.draw.line(screen, dkgreen, [-ox, y - y_off - oy], [width - ox, y - y_off - oy], 1)
+    x_off = width % GRID_SPACING
+    x_first = max(0, (ox + x_off) // GRID_SPACING)
+    x_last = min(width // GRID_SPACING + 1, (ox + screen.get_width() + x_off) // GRID_SPACING)
+    for x in range(x_first * GRID_SPACING, (x_last + 1) * GRID_SPACING, GRID_SPACING):
+        pygame.draw.line(screen, dkgreen, [x - x_off - ox, -oy], [x - x_off - ox, height - oy], 1)
+
+
+def draw_border(screen, origin=(0, 0), size=(SCREEN_WIDTH, SCREEN_HEIGHT)):
     # Draw a border around the driving area:
-    pts = [[0, 0],
-           [0, SCREEN_HEIGHT],
-           [SCREEN_WIDTH, SCREEN_HEIGHT],
-           [SCREEN_WIDTH, 0]]
+    (ox, oy) = origin
+    (width, height) = size
+    pts = [[0 - ox, 0 - oy],
+           [0 - ox, height - oy],
+           [width - ox, height - oy],
+           [width - ox, 0 - oy]]
     pygame.draw.lines(screen, brown, True, pts, 5)
 
 
+def set_world_size(width, height):
+    # Resize the world (in px).  The world is never smaller than the screen.
+    WORLDRECT.size = (max(width, SCREEN_WIDTH), max(height, SCREEN_HEIGHT))
+
+
+def draw_image(surface, offset, image, rect):
+    surface.blit(image, (rect[0] - offset[0], rect[1] - offset[1]))
+
+
+def draw_outline(surface, offset, outline, center, color=blue):
+    (ox, oy) = offset
+    pts = [[x - ox, y - oy] for (x, y) in outline]
+    pygame.draw.polygon(surface, color, pts, 2)
+    pygame.draw.circle(surface, black, [center[0] - ox, center[1] - oy], 2, 0)
+
+
+def draw_laser(surface, offset, center, vec):
+    (cx, cy) = (center[0] - offset[0], center[1] - offset[1])
+    pygame.draw.lines(surface, red, False, [[cx, cy], [cx + vec[0], cy + vec[1]]], 2)
+
+
 def m2px(val):
     # Convert meters to pixels
     return int(val * PIXELS_PER_METER)
@@ -96,8 +163,16 @@ def px2m(val):
     return val / m2px(1.0)
 
 
+# An immutable record of how to draw a sprite: 'draw(surface, offset, *args)' draws it onto
+# a surface whose top left corner is at world px 'offset'.  'rect' is used for culling.
+SpriteState = namedtuple('SpriteState', 'rect draw args')
+
+
 ### Define some classes here for the different sprite types.
 class Meter2PixSprite(pygame.sprite.Sprite):
+    # pygame's Sprite keeps a __dict__, so slots only keep these attributes out of it
+    __slots__ = ('image', 'rect', '_pospx', '_pos')
+
     def __init__(self):
         pygame.sprite.Sprite.__init__(self, self.containers)
 
@@ -115,6 +190,10 @@ class Meter2PixSprite(pygame.sprite.Sprite):
     def _convert_pos(self):
         self._pospx = tuple([m2px(x) for x in self._pos])
 
+    def draw_state(self):
+        rect = tuple(self.rect)
+        return SpriteState(rect, draw_image, (self.image, rect))
+
 
 # The WildCat object isn't a true sprite type because it doesn't use an image to draw itself, 
 # but it works for now
@@ -127,43 +206,54 @@ class WildCat(Meter2PixSprite):
     N_GRAPHS = 2
     RELOAD_TIME = 1 / 6.0
     DIMS = (m2px(1.4), m2px(0.6))
-
-    def __init__(self, joystick, clock):
+    # Steering limits and filters (cutoff frequency, quality)
+    XD_LIMITS = (-3.0, 9.5, 1.5, 0.5, 7.0)
+    YD_LIMITS = (-0.5, 0.5, 0.75)
+    RZD_LIMITS = (-1.0, 1.0, 0.4 / 0.33, 0.39)
+    XD_FILTER = (0.9, 0.5)
+    RZD_FILTER = (3.0, 0.5)
+    YAW_STEPS = 256  # Number of yaw angles the collision masks are cached for
+    _masks = {}
+    # pos, yaw, reload, xd_d, yd_d, rzd_d, axes, rect, then the xd, yd and rzd steering states
+    PACKED = struct.Struct('<10d4i3dB2d3d3dB2d')
+
+    def __init__(self, joystick, clock, pos=None, color=blue):
         Meter2PixSprite.__init__(self)
         self._joy = joystick
         self._clock = clock
+        self.color = color
 
-        self._pos = [px2m(0.5 * SCREEN_WIDTH), px2m(0.5 * SCREEN_HEIGHT)]
+        # Starts in the middle of the world unless given a position (m)
+        self._pos = list(pos) if pos else [px2m(WORLDRECT.centerx), px2m(WORLDRECT.centery)]
         self._yaw = -math.pi / 2
 
         self._convert_pos()
         rsize = 2 * max(self.DIMS[0],self.DIMS[1])
         self.rect = pygame.Rect(self.pospx, (rsize, rsize))
+        self.rect.center = self.pospx
         # Hack together a surface to overwrite our last position.
         self.image = pygame.Surface(self.rect.size)
         self.image.fill(white)
         self.image.set_colorkey(white)
+        self._outline = self.outline()
 
         (self._xd_d, self._yd_d, self._rzd_d) = (0, 0, 0)
-        self._screen = pygame.display.get_surface()
+        self._axes = (0.0, 0.0, 0.0)  # The raw joystick axes last read
 
         self._reload = self.RELOAD_TIME
 
         # Set up the steering classes:
-        self.xd_steering = XdSteering(-3.0, 9.5, 1.5, 0.5, 7.0)
-        self.yd_steering = YdSteering(-0.5, 0.5, 0.75)
-        self.rzd_steering = RzdSteering(-1.0, 1.0, 0.4 / 0.33, 0.39)
+        self.xd_steering = XdSteering(*self.XD_LIMITS)
+        self.yd_steering = YdSteering(*self.YD_LIMITS)
+        self.rzd_steering = RzdSteering(*self.RZD_LIMITS)
         # and add some filters:
-        self.xd_steering.set_filter_params(1.0 / FPS, 0.9, 0.5)
-        self.rzd_steering.set_filter_params(1.0 / FPS, 3.0, 0.5)
+        self.xd_steering.set_filter_params(1.0 / FPS, *self.XD_FILTER)
+        self.rzd_steering.set_filter_params(1.0 / FPS, *self.RZD_FILTER)
 
         self.xd_steering.reset(0)
         self.yd_steering.reset(0)
         self.rzd_steering.reset(0)
 
-        self._xd_graph = SteeringGraph(0, 'xd', self.xd_steering, self._screen)
-        self._rzd_graph = SteeringGraph(1, 'rzd', self.rzd_steering, self._screen)
-
     @property
     def pos(self):
         return self._pos
@@ -176,6 +266,14 @@ class WildCat(Meter2PixSprite):
     def yaw(self):
         return self._yaw
 
+    @property
+    def axes(self):
+        return self._axes
+
+    @property
+    def joystick(self):
+        return self._joy
+
     @property
     def reloading(self):
         return self._reload >= 0
@@ -197,28 +295,57 @@ class WildCat(Meter2PixSprite):
         self._pos[0] += dx_w
         self._pos[1] += dy_w
 
-        # Clamp the robot position to the edges of the screen.
-        self._pos[0] = saturate(self._pos[0], 0, px2m(SCREEN_WIDTH))
-        self._pos[1] = saturate(self._pos[1], 0, px2m(SCREEN_HEIGHT))
+        # Clamp the robot position to the edges of the world.
+        self._pos[0] = saturate(self._pos[0], 0, px2m(WORLDRECT.width))
+        self._pos[1] = saturate(self._pos[1], 0, px2m(WORLDRECT.height))
 
         self._reload -= dt
 
-        self._convert_pos()
-        self.rect.center = self.pospx
         # Move the robot
-        self.draw()
+        self._moved()
 
         # Shoot the laser
         # Not sure if this should be handled here...?
 
-        self._xd_graph.graph()
-        self._rzd_graph.graph()
+    def confine(self, rect):
+        ''' Keep the robot inside 'rect' (px), the way it is kept inside the world. '''
+        pos = [saturate(self._pos[0], px2m(rect.left), px2m(rect.right)),
+               saturate(self._pos[1], px2m(rect.top), px2m(rect.bottom))]
+        if pos != self._pos:
+            self._pos = pos
+            self._moved()
+
+    def _moved(self):
+        self._convert_pos()
+        self.rect.center = self.pospx
+        self._outline = self.outline()
+        self.create_rect(self._outline)
+
+    def pack(self):
+        return self.PACKED.pack(*(tuple(self._pos) + (self._yaw, self._reload, self._xd_d, self._yd_d, self._rzd_d) +
+                                  self._axes + tuple(self.rect) + self.xd_steering.get_state() +
+                                  self.yd_steering.get_state() + self.rzd_steering.get_state()))
+
+    def unpack(self, data):
+        v = self.PACKED.unpack(data)
+        self._pos = list(v[0:2])
+        (self._yaw, self._reload, self._xd_d, self._yd_d, self._rzd_d) = v[2:7]
+        self._axes = v[7:10]
+        self.rect = pygame.Rect(v[10:14])
+        self.xd_steering.set_state(v[14:20])
+        self.yd_steering.set_state(v[20:23])
+        self.rzd_steering.set_state(v[23:29])
+        self._convert_pos()
+        self._outline = self.outline()
 
     def process_joystick(self):
         # Get the requested speeds from the joystick
-        xd_req = self.XVEL_SCALE * deadband(self._joy.get_axis(JOYSTICK_CFG.X_AXIS), -self.DBAND, self.DBAND)
-        yd_req = self.YVEL_SCALE * deadband(self._joy.get_axis(JOYSTICK_CFG.Y_AXIS), -self.YDDBAND, self.YDDBAND)
-        rzd_req = self.RZD_SCALE * deadband(self._joy.get_axis(JOYSTICK_CFG.RZ_AXIS), -self.DBAND, self.DBAND)
+        self._axes = (self._joy.get_axis(JOYSTICK_CFG.X_AXIS),
+                      self._joy.get_axis(JOYSTICK_CFG.Y_AXIS),
+                      self._joy.get_axis(JOYSTICK_CFG.RZ_AXIS))
+        xd_req = self.XVEL_SCALE * deadband(self._axes[0], -self.DBAND, self.DBAND)
+        yd_req = self.YVEL_SCALE * deadband(self._axes[1], -self.YDDBAND, self.YDDBAND)
+        rzd_req = self.RZD_SCALE * deadband(self._axes[2], -self.DBAND, self.DBAND)
         # Apply slew rate limits to get the desired speeds
         # do some xd_limit hacks:
         dt = self._clock.get_time() / 1000.0
@@ -226,8 +353,8 @@ class WildCat(Meter2PixSprite):
         self._yd_d = self.yd_steering.update(yd_req, dt)
         self._rzd_d = self.rzd_steering.update(rzd_req, self._xd_d, dt)
 
-    def draw(self):
-        ''' This is where the drawing of the robot actually happens!'''
+    def outline(self):
+        ''' The outline of the robot base, in world px '''
         (xpx, ypx) = self.pospx
         # Setup the robot base drawing:
         (l, w) = self.DIMS
@@ -242,9 +369,39 @@ class WildCat(Meter2PixSprite):
             (xn, yn) = rot2d(self._yaw, p)
             p[0] = xn + xpx
             p[1] = yn + ypx
-        pygame.draw.polygon(self._screen, blue, pts, 2)
-        pygame.draw.circle(self._screen, black, [xpx, ypx], 2, 0)
-        self.create_rect(pts)
+        return pts
+
+    def draw_state(self):
+        ''' This is where the drawing of the robot actually happens!'''
+        outline = tuple((x, y) for (x, y) in self._outline)
+        return SpriteState(tuple(self.rect), draw_outline, (outline, self.pospx, self.color))
+
+    @property
+    def mask(self):
+        ''' The outline of the robot base, centered on a square of 2 * max(DIMS) px '''
+        step = int(round(self._yaw / (2 * math.pi) * self.YAW_STEPS)) % self.YAW_STEPS
+        mask = self._masks.get(step)
+        if mask is None:
+            size = 2 * max(self.DIMS)
+            (l, w) = self.DIMS
+            yaw = 2 * math.pi * step / self.YAW_STEPS
+            pts = [rot2d(yaw, p) for p in ((0.5 * l, 0.5 * w), (-0.5 * l, 0.5 * w), (-0.5 * l, -0.5 * w),
+                                           (0.5 * l, -0.5 * w), (0.5 * l + 0.5 * w, 0))]
+            surface = pygame.Surface((size, size))
+            surface.set_colorkey(black)
+            surface.fill(black)
+            pygame.draw.polygon(surface, white, [(x + size // 2, y + size // 2) for (x, y) in pts])
+            mask = self._masks[step] = pygame.mask.from_surface(surface)
+        return mask
+
+    def check_collision(self, actor):
+        # The bounding rects gate the pixel test
+        if not self.rect.colliderect(actor.rect):
+            return False
+        size = 2 * max(self.DIMS)
+        (x, y) = self.pospx
+        offset = (actor.rect.x - (x - size // 2), actor.rect.y - (y - size // 2))
+        return self.mask.overlap(actor.mask, offset) is not None
 
     def create_rect(self, pts):
         buf  = 2
@@ -267,19 +424,22 @@ class Laser(Meter2PixSprite):
     """
     LASER_VEL = (10, 0)  # meters / sec
     LASER_LEN = 14       # px
+    # Lasers expire once they could have crossed the screen
+    MAX_AGE = math.hypot(SCREEN_WIDTH, SCREEN_HEIGHT) / PIXELS_PER_METER / LASER_VEL[0]
+    PACKED = struct.Struct('<7d4i')  # pos, age, vec, vel, rect
+    __slots__ = ('_owner', '_clock', '_vec', '_vel', '_age', '_oob')
+    _blank = None  # The empty surface shared by every Laser sprite
 
-    def __init__(self, actor, screen, clock):
+    def __init__(self, actor, clock):
         Meter2PixSprite.__init__(self)
-        # Create an empty surface for this Laser sprite
         self.rect = pygame.Rect(actor.pospx, (self.LASER_LEN, self.LASER_LEN))
         self.rect.center = actor.pospx
-        self.image = pygame.Surface(self.rect.size)
-        self.image.set_alpha(0)
+        self.image = self.blank()
 
         self._pos = copy.deepcopy(actor.pos)
         self._convert_pos()
 
-        self._screen = screen
+        self._owner = actor  # The robot that fired it
         self._clock = clock
         self._vec = rot2d(actor.yaw, (self.LASER_LEN, 0))
         self._vel = rot2d(actor.yaw, self.LASER_VEL)
@@ -291,6 +451,10 @@ class Laser(Meter2PixSprite):
 
         #print "Laser created at ", self.rect.center
 
+    @property
+    def owner(self):
+        return self._owner
+
     @property
     def oob(self):
         return self._oob
@@ -312,32 +476,62 @@ class Laser(Meter2PixSprite):
         self._convert_pos()
         self.rect.center = self.pospx
 
-        self.draw()
-
         self.__check_oob()
-        if self.oob:
+        if self.oob or self._age > self.MAX_AGE:
             self.kill()
 
-    def draw(self):
-        (px, py) = self._vec
-        px += self.rect.centerx
-        py += self.rect.centery
-
-        pygame.draw.lines(self._screen, (255, 0, 0), False, [self.rect.center, [px, py]], 2)
+    def draw_state(self):
+        return SpriteState(tuple(self.rect), draw_laser, (self.rect.center, self._vec))
 
     def __check_oob(self):
-        self._oob = not self._screen.get_rect().collidepoint(self.rect.center)
+        self._oob = not WORLDRECT.collidepoint(self.rect.center)
+
+    @classmethod
+    def blank(cls):
+        # Lasers are drawn with draw_laser, so their image is an empty surface
+        if cls._blank is None:
+            cls._blank = pygame.Surface((cls.LASER_LEN, cls.LASER_LEN))
+            cls._blank.set_alpha(0)
+        return cls._blank
 
     def check_collision(self, actor):
-        return actor.rect.collidepoint(self.pospx)
+        (x, y) = self.pospx
+        if not actor.rect.collidepoint(x, y):
+            return False
+        return bool(actor.mask.get_at((x - actor.rect.x, y - actor.rect.y)))
+
+    def pack(self):
+        return self.PACKED.pack(*(tuple(self._pos) + (self._age,) + tuple(self._vec) + tuple(self._vel) +
+                                  tuple(self.rect)))
+
+    @classmethod
+    def unpack(cls, data, clock, owner):
+        v = cls.PACKED.unpack(data)
+        laser = cls.__new__(cls)
+        Meter2PixSprite.__init__(laser)
+        laser._owner = owner
+        laser._pos = list(v[0:2])
+        laser._age = v[2]
+        laser._vec = v[3:5]
+        laser._vel = v[5:7]
+        laser.rect = pygame.Rect(v[7:11])
+        laser.image = cls.blank()
+        laser._clock = clock
+        laser._oob = False
+        laser._convert_pos()
+        return laser
 
 
 class LS3(Meter2PixSprite):
     defaultlife = 3
     ticksperimg = int(0.5 * FPS)
-    SCREENRECT = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
-    SCREENRECTMETER = pygame.Rect(0, 0, px2m(SCREEN_WIDTH), px2m(SCREEN_HEIGHT))
     images = []
+    masks = {}
+    count = 0  # Number of LS3s created so far
+    # pos, random walk, life, frame, update phase, skipped frames, image, rect, x and y
+    # filter states
+    PACKED = struct.Struct('<4d4iB4iB2dB2d')
+    __slots__ = ('life', 'frame', 'update_phase', 'skipped', '_randwalk', '_xfilt', '_yfilt')
 
     def __init__(self, p0):
         Meter2PixSprite.__init__(self)
@@ -349,23 +543,33 @@ class LS3(Meter2PixSprite):
         self.life = self.defaultlife
         # Keep track of which image we're on.
         self.frame = 0
+        # Spread the updates of far away LS3s evenly over the frames
+        self.update_phase = LS3.count % FAR_UPDATE_DIV
+        self.skipped = 0  # Frames since the last update
+        LS3.count += 1
 
         self._randwalk = copy.deepcopy(self._pos)
         self._xfilt = Filter2ndOrder(1.0 / FPS, 0.05)
         self._yfilt = Filter2ndOrder(1.0 / FPS, 0.05)
 
+    @property
+    def mask(self):
+        return self.masks[self.image]
+
     def update(self):
-        ''' Update the LS3 position here! '''
-        self.frame += 1
-        self._randwalk[0] += random.choice([-1, 1]) * 10.4 / FPS
-        self._randwalk[1] += random.choice([-1, 1]) * 10.4 / FPS
+        ''' Update the LS3 position here!  It catches up on the frames it has skipped. '''
+        steps = self.skipped + 1
+        self.skipped = 0
+        self.frame += steps
+        self._randwalk[0] += random_steps(steps) * 10.4 / FPS
+        self._randwalk[1] += random_steps(steps) * 10.4 / FPS
         x_old = self._pos[0]
-        self._pos[0] = self._xfilt.filter_val(self._randwalk[0])
-        self._pos[1] = self._yfilt.filter_val(self._randwalk[1])
+        self._pos[0] = self._xfilt.filter_val(self._randwalk[0], steps)
+        self._pos[1] = self._yfilt.filter_val(self._randwalk[1], steps)
         self._convert_pos()
         self.rect.center = self.pospx
-        if not self.SCREENRECT.contains(self.rect):
-            self.rect = self.rect.clamp(self.SCREENRECT)
+        if not WORLDRECT.contains(self.rect):
+            self.rect = self.rect.clamp(WORLDRECT)
             self._pos = [px2m(self.rect.centerx), px2m(self.rect.centery)]
         dx = self._pos[0] - x_old
         if dx <= 0:
@@ -382,11 +586,35 @@ class LS3(Meter2PixSprite):
 
         if self.life <= 0: self.kill()
 
+    def pack(self):
+        return self.PACKED.pack(*(tuple(self._pos) + tuple(self._randwalk) +
+                                  (self.life, self.frame, self.update_phase, self.skipped,
+                                   self.images.index(self.image)) +
+                                  tuple(self.rect) + self._xfilt.get_state() + self._yfilt.get_state()))
+
+    @classmethod
+    def unpack(cls, data):
+        v = cls.PACKED.unpack(data)
+        ls3 = cls.__new__(cls)
+        Meter2PixSprite.__init__(ls3)
+        ls3._pos = list(v[0:2])
+        ls3._randwalk = list(v[2:4])
+        (ls3.life, ls3.frame, ls3.update_phase, ls3.skipped) = v[4:8]
+        ls3.image = cls.images[v[8]]
+        ls3.rect = pygame.Rect(v[9:13])
+        ls3._xfilt = Filter2ndOrder(1.0 / FPS, 0.05)
+        ls3._yfilt = Filter2ndOrder(1.0 / FPS, 0.05)
+        ls3._xfilt.set_state(v[13:16])
+        ls3._yfilt.set_state(v[16:19])
+        ls3._convert_pos()
+        return ls3
+
 
 class Explosion(pygame.sprite.Sprite):
     defaultlife = 12
     animcycle = 3
     images = []
+    PACKED = struct.Struct('<iB4i')  # life, image, rect
 
     def __init__(self, actor):
         pygame.sprite.Sprite.__init__(self, self.containers)
@@ -399,38 +627,471 @@ class Explosion(pygame.sprite.Sprite):
         self.image = self.images[self.life // self.animcycle % 2]
         if self.life <= 0: self.kill()
 
+    def draw_state(self):
+        rect = tuple(self.rect)
+        return SpriteState(rect, draw_image, (self.image, rect))
+
+    def pack(self):
+        return self.PACKED.pack(self.life, self.images.index(self.image), *self.rect)
+
+    @classmethod
+    def unpack(cls, data):
+        v = cls.PACKED.unpack(data)
+        explosion = cls.__new__(cls)
+        pygame.sprite.Sprite.__init__(explosion, cls.containers)
+        explosion.life = v[0]
+        explosion.image = cls.images[v[1]]
+        explosion.rect = pygame.Rect(v[2:6])
+        return explosion
+
+
+class Camera:
+    ''' The part of the world (in px) that is shown on the screen '''
+
+    def __init__(self, width, height):
+        self.rect = pygame.Rect(0, 0, width, height)
+        self.rect.center = WORLDRECT.center
+
+    @property
+    def offset(self):
+        return self.rect.topleft
+
+    def follow(self, pospx):
+        # Keep 'pospx' in the middle of the view without looking past the edge of the world
+        self.rect.center = pospx
+        self.rect.clamp_ip(WORLDRECT)
+
+
+class BackgroundTiles:
+    '''
+    The background (grid and border) of the world, pre-rendered in square tiles.  Tiles are
+    rendered the first time they come into view and the least recently used ones are
+    dropped once there are more than 'max_tiles' of them.
+    '''
+
+    def __init__(self, tile_size=TILE_SIZE, max_tiles=MAX_TILES):
+        self._tile_size = tile_size
+        self._max_tiles = max_tiles
+        self._tiles = OrderedDict()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def tile(self, tx, ty):
+        key = (tx, ty)
+        surface = self._tiles.get(key)
+        if surface is None:
+            surface = self._render(tx, ty)
+            self._tiles[key] = surface
+            if len(self._tiles) > self._max_tiles:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+        return surface
+
+    def _render(self, tx, ty):
+        surface = pygame.Surface((self._tile_size, self._tile_size)).convert()
+        origin = (tx * self._tile_size, ty * self._tile_size)
+        draw_background(surface)
+        draw_grid(surface, origin, WORLDRECT.size)
+        draw_border(surface, origin, WORLDRECT.size)
+        return surface
+
+    def draw(self, surface, view):
+        # Blit the tiles covering 'view' (a rect in world px) onto 'surface'
+        size = self._tile_size
+        view = pygame.Rect(view)
+        for ty in range(view.top // size, (view.bottom - 1) // size + 1):
+            for tx in range(view.left // size, (view.right - 1) // size + 1):
+                surface.blit(self.tile(tx, ty), (tx * size - view.left, ty * size - view.top))
+
+
+def update_sprites(nearby, far, camera, frame):
+    '''
+    Update the sprites in the group 'nearby' every frame.  LS3s that wander away from the
+    camera's view move to 'far', a group per update phase, and each of those groups is only
+    updated every FAR_UPDATE_DIV frames, so far LS3s cost nothing in between.  They catch up
+    on the frames they skipped when they are updated.
+    '''
+    near = camera.rect.inflate(2 * NEAR_MARGIN, 2 * NEAR_MARGIN)
+    for s in nearby.sprites():
+        s.update()
+        if isinstance(s, LS3) and s.alive() and not near.colliderect(s.rect):
+            # Frames until its phase comes up
+            s.skipped = -(frame + 1 + s.update_phase) % FAR_UPDATE_DIV
+            nearby.remove(s)
+            far[s.update_phase].add(s)
+
+    due = far[-frame % FAR_UPDATE_DIV]
+    for s in due.sprites():
+        s.update()
+        if not s.alive():
+            continue
+        # Far LS3s are only checked when they're updated; NEAR_MARGIN keeps them out of
+        # view until then.
+        if near.colliderect(s.rect):
+            due.remove(s)
+            nearby.add(s)
+        else:
+            s.skipped = FAR_UPDATE_DIV - 1
+
+
+def draw_sprites(surface, view, sprites):
+    # Draw the SpriteStates in 'sprites' that lie inside 'view' (a rect in world px)
+    view = pygame.Rect(view)
+    offset = view.topleft
+    for st in sprites:
+        if view.colliderect(st.rect):
+            st.draw(surface, offset, *st.args)
+
+
+# Immutable copies of the state of the world, handed from the simulation to the renderer.
+# 'robots' holds a RobotState for each WildCat.
+SteeringState = namedtuple('SteeringState', 'min max cmd_req cmd_d_unfilt cmd_d')
+RobotState = namedtuple('RobotState', 'color alive xd yd rzd')
+Snapshot = namedtuple('Snapshot', 'frame time view sprites robots easter_egg')
+
+
+def steering_state(steering):
+    return SteeringState(steering.min, steering.max, steering.cmd_req, steering.cmd_d_unfilt, steering.cmd_d)
+
+
+def robot_state(wildcat):
+    return RobotState(wildcat.color, wildcat.alive(), steering_state(wildcat.xd_steering),
+                      steering_state(wildcat.yd_steering), steering_state(wildcat.rzd_steering))
+
+
+# Tags that mark the type of each sprite in a packed Simulation; WildCats are followed by
+# their index
+SPRITE_TAGS = {WildCat: b'W', Laser: b'L', LS3: b'S', Explosion: b'E'}
+ROBOT_INDEX = struct.Struct('<B')
+GROUP_SIZE = struct.Struct('<I')
+# The state of the random module: version, the Mersenne Twister state and gauss_next
+RANDOM_STATE = struct.Struct('<B625IBd')
+
+
+class Simulation:
+    '''
+    The game world: a WildCat for each joystick in 'joysticks', LS3s, lasers and
+    explosions.  'step' advances the world by one frame and 'snapshot' returns an immutable
+    copy of everything needed to draw it, so the world can be stepped on one thread and
+    drawn on another.  The robots share the world, the collision checks and the view,
+    which follows the middle of the robots that are still alive.
+
+    'save_state' packs the complete state of the world, including the random number
+    generator, into a few kB and 'load_state' restores it, so a run can be rewound or many
+    variants can be run on from the same checkpoint.  A checkpoint is kept every
+    CHECKPOINT_INTERVAL frames for 'rewind'.
+    '''
+    # frame, time, easter egg, LS3 reload, camera rect, LS3 count, number of sprites
+    PACKED = struct.Struct('<qdBi4iqi')
+
+    def __init__(self, joysticks, clock):
+        self.robots = pygame.sprite.Group()  # The WildCats that are still alive
+        self.ls3s = pygame.sprite.Group()
+        self.lasers = pygame.sprite.Group()
+        self.allsprite = pygame.sprite.RenderUpdates()
+        # The sprites that are updated every frame, and the far LS3s; see update_sprites
+        self.nearby = pygame.sprite.Group()
+        self.far_ls3s = [pygame.sprite.Group() for _ in range(FAR_UPDATE_DIV)]
+
+        # assign default groups to each sprite class
+        WildCat.containers = self.robots, self.allsprite, self.nearby
+        LS3.containers = self.ls3s, self.allsprite, self.nearby
+        Laser.containers = self.lasers, self.allsprite, self.nearby
+        Explosion.containers = self.allsprite, self.nearby
+        LS3.count = 0
+
+        self.clock = clock
+        self.camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT)
+        # The robots start side by side in the middle of the world
+        n = len(joysticks)
+        self.wildcats = [WildCat(joy, clock,
+                                 (px2m(WORLDRECT.centerx) + (i - (n - 1) / 2.0) * ROBOT_SPACING, px2m(WORLDRECT.centery)),
+                                 ROBOT_COLORS[i % len(ROBOT_COLORS)])
+                         for (i, joy) in enumerate(joysticks)]
+
+        self.easter_egg = False
+        self.trigger = False   # An extra fire button (the space bar) for the first robot
+        self.fired = [False] * n  # Whether each robot's fire was pressed in the latest step
+        self.telemetry = []    # Called with a telemetry_row after every step
+        self.frame = 0
+        self.time = 0.0
+        self._ls3_reload = LS3_RELOAD
+
+        self.checkpoints = CheckpointRing()
+        self.checkpoints.record(self)
+        self._rewind = False
+
+    @property
+    def wildcat(self):
+        # The first robot, which telemetry and replays follow
+        return self.wildcats[0]
+
+    @property
+    def joystick(self):
+        return self.wildcat.joystick
+
+    def rewind(self):
+        # Go back to an earlier checkpoint before the next step
+        self._rewind = True
+
+    def step(self):
+        if self._rewind:
+            self._rewind = False
+            self.checkpoints.rewind(self)
+
+        if self.easter_egg:
+            if self._ls3_reload:
+                self._ls3_reload -= 1
+            elif not int(random.random() * LS3_ODDS):
+                view = self.camera.rect
+                LS3((random.randint(view.left, view.right), random.randint(view.top, view.bottom)))
+                self._ls3_reload = LS3_RELOAD
+
+        for (i, wildcat) in enumerate(self.wildcats):
+            joy = wildcat.joystick
+            self.fired[i] = bool(joy.get_button(JOYSTICK_CFG.LBUMP) or joy.get_button(JOYSTICK_CFG.RBUMP) or
+                                 (i == 0 and self.trigger))
+            if (self.fired[i] and wildcat.alive() and (not wildcat.reloading) and
+                    sum(1 for laser in self.lasers if laser.owner is wildcat) < MAX_SHOTS):
+                Laser(wildcat, self.clock)
+
+        update_sprites(self.nearby, self.far_ls3s, self.camera, self.frame)
+
+        if not self.easter_egg and len(self.ls3s) > 0:
+            for rbt in self.ls3s:
+                Explosion(rbt)
+                rbt.kill()
+            self.ls3s.empty()
+
+        # Check for laser to robot collisions, for every robot's lasers in one pass.
+        # The laser's position is tested against the LS3's image mask.
+        for hits in pygame.sprite.groupcollide(self.lasers, self.ls3s, 1, 1, Laser.check_collision).values():
+            for rbt in hits:
+                Explosion(rbt)
+
+        # Check for wildcat to robot collisions
+        for (wildcat, hits) in pygame.sprite.groupcollide(self.robots, self.ls3s, 1, 1,
+                                                         WildCat.check_collision).items():
+            Explosion(wildcat)
+            for rbt in hits:
+                Explosion(rbt)
+
+        # Scroll the view with the robots
+        if self.robots:
+            centers = [wildcat.pospx for wildcat in self.robots]
+            self.camera.follow((sum(x for (x, _) in centers) // len(centers),
+                                sum(y for (_, y) in centers) // len(centers)))
+            if len(self.wildcats) > 1:
+                # The robots share the view, so none of them may drive out of it
+                margin = max(WildCat.DIMS)
+                view = self.camera.rect.inflate(-2 * margin, -2 * margin)
+                for wildcat in self.robots:
+                    wildcat.confine(view)
+
+        self.time += self.clock.get_time() / 1000.0
+        if self.telemetry:
+            row = telemetry_row(self)
+            for record in self.telemetry:
+                record(row)
+        self.frame += 1
+        self.checkpoints.record(self)
+
+    def save_state(self):
+        (version, internal, gauss) = random.getstate()
+        parts = [self.PACKED.pack(self.frame, self.time, self.easter_egg, self._ls3_reload,
+                                  *self.camera.rect, LS3.count, len(self.allsprite)),
+                 RANDOM_STATE.pack(version, *internal, gauss is not None, gauss or 0.0)]
+        parts.extend(wildcat.pack() for wildcat in self.wildcats)
+        sprites = self.allsprite.sprites()
+        for s in sprites:
+            parts.append(SPRITE_TAGS[type(s)])
+            if isinstance(s, WildCat):
+                parts.append(ROBOT_INDEX.pack(self.wildcats.index(s)))
+            else:
+                parts.append(s.pack())
+                if isinstance(s, Laser):
+                    parts.append(ROBOT_INDEX.pack(self.wildcats.index(s.owner)))
+        # The sprites are updated group by group, in the order they were added to each
+        # group, which has to be kept for exact playback
+        index = {s: i for (i, s) in enumerate(sprites)}
+        for group in [self.nearby] + self.far_ls3s:
+            parts.append(GROUP_SIZE.pack(len(group)))
+            parts.append(struct.pack('<%dI' % len(group), *[index[s] for s in group]))
+        return b''.join(parts)
+
+    def load_state(self, data):
+        v = self.PACKED.unpack_from(data)
+        (self.frame, self.time) = v[0:2]
+        self.easter_egg = bool(v[2])
+        self._ls3_reload = v[3]
+        self.camera.rect = pygame.Rect(v[4:8])
+        LS3.count = v[8]
+        n_sprites = v[9]
+        offset = self.PACKED.size
+
+        v = RANDOM_STATE.unpack_from(data, offset)
+        random.setstate((v[0], v[1:626], v[627] if v[626] else None))
+        offset += RANDOM_STATE.size
+
+        for wildcat in self.wildcats:
+            wildcat.unpack(data[offset:offset + WildCat.PACKED.size])
+            offset += WildCat.PACKED.size
+
+        for s in self.allsprite.sprites():
+            s.kill()
+        classes = {tag: cls for (cls, tag) in SPRITE_TAGS.items()}
+        sprites = []
+        for _ in range(n_sprites):
+            cls = classes[data[offset:offset + 1]]
+            offset += 1
+            if cls is WildCat:
+                (i,) = ROBOT_INDEX.unpack_from(data, offset)
+                offset += ROBOT_INDEX.size
+                self.wildcats[i].add(self.robots, self.allsprite)
+                sprites.append(self.wildcats[i])
+                continue
+            packed = data[offset:offset + cls.PACKED.size]
+            offset += cls.PACKED.size
+            if cls is Laser:
+                (i,) = ROBOT_INDEX.unpack_from(data, offset)
+                offset += ROBOT_INDEX.size
+                sprites.append(Laser.unpack(packed, self.clock, self.wildcats[i]))
+            else:
+                sprites.append(cls.unpack(packed))
+
+        for group in [self.nearby] + self.far_ls3s:
+            (n,) = GROUP_SIZE.unpack_from(data, offset)
+            offset += GROUP_SIZE.size
+            order = struct.unpack_from('<%dI' % n, data, offset)
+            offset += 4 * n
+            group.empty()
+            group.add(*[sprites[i] for i in order])
+
+    def snapshot(self):
+        view = self.camera.rect
+        sprites = tuple(s.draw_state() for s in self.allsprite if view.colliderect(s.rect))
+        return Snapshot(self.frame, self.time, tuple(view), sprites,
+                        tuple(robot_state(wildcat) for wildcat in self.wildcats), self.easter_egg)
+
+
+class CheckpointRing:
+    ''' The latest 'capacity' checkpoints of a Simulation, taken every 'interval' frames '''
+
+    def __init__(self, interval=CHECKPOINT_INTERVAL, capacity=MAX_CHECKPOINTS):
+        self._interval = interval
+        self._checkpoints = deque([], capacity)  # (frame, packed state)
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    def record(self, sim):
+        if sim.frame % self._interval == 0:
+            self._checkpoints.append((sim.frame, sim.save_state()))
+
+    def rewind(self, sim):
+        # Go back to the latest checkpoint that is at least one interval old, so repeated
+        # rewinds keep going further back.  The oldest checkpoint is always kept.
+        while len(self._checkpoints) > 1 and self._checkpoints[-1][0] > sim.frame - self._interval:
+            self._checkpoints.pop()
+        if self._checkpoints:
+            sim.load_state(self._checkpoints[-1][1])
+
+
+class SnapshotBuffer:
+    '''
+    Hands the latest Snapshot from the simulation to the renderer.  Snapshots are never
+    changed once published, so swapping a single reference is all it takes.
+    '''
+
+    def __init__(self):
+        self._latest = None
+
+    def publish(self, snapshot):
+        self._latest = snapshot
+
+    def latest(self):
+        return self._latest
+
+
+class SimulationThread(threading.Thread):
+    ''' Steps a Simulation at a fixed rate, publishing a snapshot after every step. '''
+
+    def __init__(self, sim, snapshots, rate=FPS):
+        threading.Thread.__init__(self, name='Simulation', daemon=True)
+        self._sim = sim
+        self._snapshots = snapshots
+        self._period = 1.0 / rate
+        self._stop_event = threading.Event()
+        self._steps = deque([], int(rate))  # Times of the latest steps, to measure the rate
+
+    @property
+    def rate(self):
+        if len(self._steps) < 2:
+            return 0.0
+        return (len(self._steps) - 1) / (self._steps[-1] - self._steps[0])
+
+    def run(self):
+        next_step = time.perf_counter()
+        while not self._stop_event.is_set():
+            self._sim.step()
+            self._snapshots.publish(self._sim.snapshot())
+
+            now = time.perf_counter()
+            self._steps.append(now)
+            next_step += self._period
+            if next_step > now:
+                self._stop_event.wait(next_step - now)
+            else:
+                # Running late; carry on from now rather than stepping in a burst
+                next_step = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
 
 class SteeringGraph:
     GRAPH_HEIGHT = 150
 
-    def __init__(self, gid, name, steering, screen):
-        # Here is where we'll put all of the graphing data
+    def __init__(self, gid, name, screen, column=0, n_columns=1):
+        # Here is where we'll put all of the graphing data.  With several robots, each one's
+        # graphs are in a column of their own.
         self._name = name
         self._gid = gid
-        self._steering = steering
-        self._screen = screen.subsurface((0, SCREEN_HEIGHT + self._gid * self.GRAPH_HEIGHT),
-                                         (screen.get_width(), self.GRAPH_HEIGHT))
+        self._label = name if n_columns == 1 else "%d: %s" % (column + 1, name)
+        self._steering = None
+        width = screen.get_width() // n_columns
+        self._screen = screen.subsurface((column * width, SCREEN_HEIGHT + self._gid * self.GRAPH_HEIGHT),
+                                         (width, self.GRAPH_HEIGHT))
         self._cmd_d = deque([], self._screen.get_width())
         self._cmd_req = deque([], self._screen.get_width())
+        # Setup a font for rendering the text
+        self._font = pygame.font.Font(pygame.font.match_font("consolas"), 16)
+
+    @property
+    def name(self):
+        return self._name
 
-    def graph(self):
-        # This is where we'll graph the stuff
+    def graph(self, steering):
+        # This is where we'll graph the stuff.  'steering' is a SteeringProcessor or SteeringState
+        self._steering = steering
         self._cmd_d.append(self._steering.cmd_d)
         self._cmd_req.append(self._steering.cmd_req)
         self.draw_joystick_command()
         self.add_labels()
 
     def add_labels(self):
-        # Setup a font for rendering the text
-        myFont = pygame.font.Font(pygame.font.match_font("consolas"), 16)
+        myFont = self._font
         # Label the xd graph
-        txt_graph = myFont.render(self._name + "_req", 1, GRAPH_COLORS[0], white)
+        txt_graph = myFont.render(self._label + "_req", 1, GRAPH_COLORS[0], white)
         txt_pos = txt_graph.get_rect()
         txt_pos.x = 10
         txt_pos.top = 10
         self._screen.blit(txt_graph, txt_pos)
         txt_pos_last = txt_pos
-        txt_graph = myFont.render(self._name + "_d", 1, GRAPH_COLORS[1], white)
+        txt_graph = myFont.render(self._label + "_d", 1, GRAPH_COLORS[1], white)
         txt_pos = txt_graph.get_rect()
         txt_pos.x = 10
         txt_pos.top = txt_pos_last.bottom
@@ -453,7 +1114,113 @@ class SteeringGraph:
                 pygame.draw.lines(self._screen, GRAPH_COLORS[cmd.index(c)], False, pts, 2)
 
 
-def main():
+class Renderer:
+    '''
+    Draws Snapshots of the world, the steering graphs and the HUD onto the screen.  The
+    world is drawn once for all 'n_robots' robots; each robot has its own graphs and HUD.
+    '''
+
+    def __init__(self, screen, n_robots=1):
+        self._screen = screen
+        # The part of the screen that shows the world
+        self._view = screen.subsurface(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        self._background = BackgroundTiles()
+        self._graphs = [[SteeringGraph(i, name, screen, robot, n_robots)
+                         for (i, name) in enumerate(('xd', 'rzd')[:WildCat.N_GRAPHS])]
+                        for robot in range(n_robots)]
+        # Set up a font for rendering text:
+        self._font = pygame.font.Font(pygame.font.match_font("consolas"), 16)
+
+    def render(self, snap):
+        self._background.draw(self._view, snap.view)
+        draw_sprites(self._view, snap.view, snap.sprites)
+
+        for (robot, graphs) in zip(snap.robots, self._graphs):
+            for g in graphs:
+                g.graph(getattr(robot, g.name))
+
+        # Here we'll display some metrics to the drivers:
+        top = 5
+        for (i, robot) in enumerate(snap.robots):
+            lines = [("%-7s = % .2f | %-5s = % .2f" % (name + "_req", getattr(robot, name).cmd_req,
+                                                        name + "_d", getattr(robot, name).cmd_d), black)
+                     for name in ('xd', 'yd', 'rzd')]
+            if len(snap.robots) > 1:
+                lines.insert(0, ("WildCat %d" % (i + 1) + ("" if robot.alive else " (crashed)"), robot.color))
+            for (text, color) in lines:
+                txt = self._font.render(text, 1, color, white)
+                txt_pos = txt.get_rect()
+                txt_pos.x = 10
+                txt_pos.top = top
+                self._screen.blit(txt, txt_pos)
+                top = txt_pos.bottom
+
+
+def parse_world_size(text):
+    try:
+        (w, h) = [float(v) for v in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("world size must look like WIDTHxHEIGHT, e.g. 2000x2000")
+    return (w, h)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WildCat driving simulator")
+    parser.add_argument('--telemetry', action='store_true',
+                        help="publish steering telemetry to shared memory and plot it in a separate process "
+                             "(with several robots, the first one's)")
+    parser.add_argument('--log', metavar='DIR', help="log steering telemetry for the session to DIR, which mustn't hold a session yet "
+                             "(with several robots, only the first is logged)")
+    parser.add_argument('--world', type=parse_world_size, default=None, metavar='WxH',
+                        help="size of the world in meters (default: the size of the screen)")
+    parser.add_argument('--threaded', action='store_true',
+                        help="run the simulation on its own thread at a fixed rate, independent of drawing")
+    parser.add_argument('--seed', type=int, help="seed for the random number generator")
+    parser.add_argument('--replay', metavar='DIR',
+                        help="play back a session logged with --log (F fast forwards, 1 returns to normal speed)")
+    parser.add_argument('--capture', metavar='PATH',
+                        help="capture every frame to a video file (through ffmpeg) or a directory of PNGs")
+    parser.add_argument('--headless', action='store_true',
+                        help="don't open a window; replays run as fast as possible")
+    parser.add_argument('--no-graphs', action='store_true', help="don't draw the in-game steering graphs")
+    parser.add_argument('--robots', type=int, metavar='N',
+                        help="number of robots, each driven by its own joystick (default: one per joystick)")
+    args = parser.parse_args(argv)
+    if args.replay and args.threaded:
+        parser.error("--replay can't be combined with --threaded")
+    if args.robots is not None and args.robots < 1:
+        parser.error("--robots must be at least 1")
+    if args.replay and (args.robots or 1) > 1:
+        parser.error("--replay plays back a single robot")
+    return args
+
+
+def main(args=None):
+    if args is None:
+        args = parse_args()
+    if args.no_graphs:
+        WildCat.N_GRAPHS = 0
+    if args.headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+    # A replayed session starts from the world and random seed it was recorded with
+    try:
+        replay = SessionReplay(args.replay) if args.replay else None
+    except ValueError as e:
+        raise SystemExit(e)
+    if replay:
+        if replay.meta.get('robots', 1) > 1:
+            # Only the first robot's inputs are logged
+            raise SystemExit("'%s' was logged with several robots and can't be replayed." % args.replay)
+        args.world = replay.meta.get('world')
+        seed = replay.meta['seed']
+    else:
+        seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    random.seed(seed)
+
+    if args.world:
+        set_world_size(m2px(args.world[0]), m2px(args.world[1]))
+
     # Initialize PyGame
     pygame.init()
 
@@ -466,6 +1233,7 @@ def main():
     LS3.images = img + [pygame.transform.flip(im, 1, 0) for im in img]
     img = load_image('explosion1.gif', -1)
     Explosion.images = [img, pygame.transform.flip(img, 1, 1)]
+    LS3.masks = load_masks(LS3.images)
 
     # Decorate the game window with things like:
     #icon = pygame.transform.scale(load_image('icon_here.png'), (32,32))
@@ -473,158 +1241,158 @@ def main():
     #pygame.display.set_caption('WildCat driving simulator')
     #pygame.mouse.set_visible(0)
 
-    background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-    draw_background(background)
-    draw_grid(background)
-    draw_border(background)
-    screen.blit(background, (0, 0))
-    pygame.display.flip()
-
-    # Initialize Game Groups
-    player = pygame.sprite.GroupSingle()
-    ls3s = pygame.sprite.Group()
-    lasers = pygame.sprite.Group()
-    allsprite = pygame.sprite.RenderUpdates()
-    lastls3 = pygame.sprite.GroupSingle()
-
-    #assign default groups to each sprite class
-    WildCat.containers = allsprite
-    LS3.containers = ls3s, allsprite, lastls3
-    Laser.containers = lasers, allsprite
-    Explosion.containers = allsprite
-
-    # Set up a font for rendering text:
-    myFont = pygame.font.Font(pygame.font.match_font("consolas"), 16)
-
-    #Setup some game variables
-    EasterEggMode = False
-    Ls3Reload = LS3_RELOAD
-
     # Count the joysticks the computer has
     joystick_count = pygame.joystick.get_count()
-    if joystick_count == 0:
+    if replay:
+        # The recorded inputs stand in for the joystick
+        my_joystick = ScriptedJoystick("Replay of " + args.replay)
+        joysticks = [my_joystick]
+    elif joystick_count == 0:
         # No joysticks!
         print ("Error, I didn't find any joysticks.")
         print ("Please connect a joystick to continue.")
+        print ("(To drive the simulator from code, use wildcat_env.WildCatVecEnv.)")
         pygame.quit()
+        return
+    elif (args.robots or 1) > joystick_count:
+        print ("Error, %d robots need %d joysticks but I only found %d." % (args.robots, args.robots, joystick_count))
+        pygame.quit()
+        return
     else:
         # pdb.set_trace()
-        # Use joystick #0 and initialize it
-        my_joystick = pygame.joystick.Joystick(0)
-        my_joystick.init()
+        # Use a joystick for each robot and initialize them
+        joysticks = [pygame.joystick.Joystick(i) for i in range(args.robots or joystick_count)]
+        for joy in joysticks:
+            joy.init()
 
     # Create a clock
     clock = pygame.time.Clock()
     # Init the clock
     clock.tick()
 
-    wildcat = WildCat(my_joystick, clock)
-    ### Create a container for the lasers.  A simple list with work.
-    ##lasers = []
+    snapshots = SnapshotBuffer()
+    sim_thread = None
+    if args.threaded:
+        # The simulation reads copies of the joysticks that are refreshed every frame, since
+        # the joysticks themselves must only be used from the thread that handles the events.
+        inputs = [ScriptedJoystick(joy.get_name()) for joy in joysticks]
+        for (mirror, joy) in zip(inputs, joysticks):
+            mirror.copy_from(joy)
+        sim = Simulation(inputs, FixedStepClock(1.0 / FPS))
+    elif replay:
+        sim_clock = FixedStepClock(1.0 / FPS)
+        sim = Simulation(joysticks, sim_clock)
+    else:
+        sim = Simulation(joysticks, clock)
+    snapshots.publish(sim.snapshot())
+    renderer = Renderer(screen, len(joysticks))
 
     done = False
 
-    print(wildcat.alive())
-
-    pygame.key.set_repeat()  # Disables key repeats.
-
-    while not done:  # wildcat.alive():
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT or \
-                    (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
-                done = True
-            if event.type == pygame.KEYDOWN and event.key == pygame.K_e:
-                EasterEggMode = not EasterEggMode
-
-        keystate = pygame.key.get_pressed()
-
-        # Decorate the game window
-        caption = "FPS: %.2f" % (clock.get_fps())
-        if EasterEggMode:
-            caption = caption + "  -  Get the LS3s!"
-            
-            if Ls3Reload:
-                Ls3Reload -= 1
-            elif not int(random.random() * LS3_ODDS):
-                LS3((random.randint(0, SCREEN_WIDTH), random.randint(0, SCREEN_HEIGHT)))
-                Ls3Reload = LS3_RELOAD
-
-
-        pygame.display.set_caption(caption)
-
-        # As long as there is a joystick
-        if joystick_count != 0:
-            if (my_joystick.get_button(JOYSTICK_CFG.LBUMP) or my_joystick.get_button(JOYSTICK_CFG.RBUMP) \
-                or keystate[pygame.K_SPACE]) and \
-                (not wildcat.reloading) and (len(lasers) < MAX_SHOTS):
-                Laser(wildcat, screen.subsurface(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT), clock)
-
-        dt = clock.get_time() / 1000.0
-
-        allsprite.clear(screen, background)
-
-        allsprite.update()
-
-        if not EasterEggMode and len(ls3s) > 0:
-            for rbt in ls3s:
-                Explosion(rbt)
-                rbt.kill()
-            ls3s.empty()
-
-        # Check for laser to robot collisions
-        #for rbt in pygame.sprite.groupcollide(lasers, ls3s, 1, 1).keys():
-        #    Explosion(rbt)
-        # A bit hacky, but use collidepoint to do collision check.o
-        for l in lasers:
-            for rbt in pygame.sprite.spritecollide(l, ls3s, 1, Laser.check_collision):
-                Explosion(rbt)
-                rbt.kill()
-                l.kill()
-
-        # Check for wildcat to robot collisions
-        for rbt in pygame.sprite.spritecollide(wildcat, ls3s, 1):
-            Explosion(wildcat)
-            Explosion(rbt)
-            wildcat.kill()
-            rbt.kill()
-
-        #for l in lasers:
-        #    l.draw()
-
-        dirty = allsprite.draw(screen)
-        pygame.display.update(dirty)
-
-
-        # Here we'll display some metrics to the driver:
-        txt_xd = myFont.render("xd_req  = % .2f | xd_d  = % .2f" % (wildcat.xd_steering.cmd_req,
-                                                                    wildcat.xd_steering.cmd_d),
-                               1, black, white)
-        txt_xd_pos = txt_xd.get_rect()
-        txt_xd_pos.x = 10
-        txt_xd_pos.top = 5
-        screen.blit(txt_xd, txt_xd_pos)
-        txt_yd = myFont.render("yd_req  = % .2f | yd_d  = % .2f" % (wildcat.yd_steering.cmd_req,
-                                                                    wildcat.yd_steering.cmd_d),
-                               1, black, white)
-        txt_yd_pos = txt_yd.get_rect()
-        txt_yd_pos.x = 10
-        txt_yd_pos.top = txt_xd_pos.bottom
-        screen.blit(txt_yd, txt_yd_pos)
-        txt_rzd = myFont.render("rzd_req = % .2f | rzd_d = % .2f" % (wildcat.rzd_steering.cmd_req,
-                                                                     wildcat.rzd_steering.cmd_d),
-                                1, black, white)
-        txt_rzd_pos = txt_rzd.get_rect()
-        txt_rzd_pos.x = 10
-        txt_rzd_pos.top = txt_yd_pos.bottom
-        screen.blit(txt_rzd, txt_rzd_pos)
-
-        pygame.display.flip()
-        clock.tick(FPS)
-
-    print(lasers)
-
-    pygame.quit()
+    print(sim.wildcat.alive())
+
+    # Everything started from here on is stopped, and the logs and captures written out,
+    # however the game ends
+    with contextlib.ExitStack() as cleanup:
+        cleanup.callback(pygame.quit)
+
+        try:
+            logger = TelemetryLogger(args.log, meta={'seed': seed, 'world': args.world,
+                                                     'robots': len(joysticks)}) if args.log else None
+        except FileExistsError as e:
+            raise SystemExit(e)
+        if logger:
+            cleanup.callback(logger.close)
+
+        # Stream the steering state to an out-of-process plotter
+        telemetry = None
+        if args.telemetry:
+            telemetry = TelemetryRing()
+            cleanup.callback(telemetry.close)
+            start_plotter(telemetry)
+            sim.telemetry.append(telemetry.push)
+        if logger:
+            sim.telemetry.append(logger.log)
+
+        recorder = FrameRecorder(args.capture, screen, FPS) if args.capture else None
+        if recorder:
+            cleanup.callback(recorder.close)
+        # Replays are rendered as fast as possible when nobody is watching
+        paced = not (replay and args.headless)
+
+        if args.threaded:
+            sim_thread = SimulationThread(sim, snapshots)
+            sim_thread.start()
+            cleanup.callback(sim_thread.stop)
+
+        pygame.key.set_repeat()  # Disables key repeats.
+
+        speed = 1  # Simulation steps per drawn frame; see TURBO_SPEEDS
+
+        while not done:  # wildcat.alive():
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or \
+                        (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    done = True
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_e:
+                    sim.easter_egg = not sim.easter_egg
+                # Replays follow the rewinds of the recorded session instead
+                if not replay and event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+                    sim.rewind()
+                # Replays can be fast forwarded, since their inputs don't depend on the frame rate
+                if replay and event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                    speed = TURBO_SPEEDS[min(TURBO_SPEEDS.index(speed) + 1, len(TURBO_SPEEDS) - 1)]
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_1:
+                    speed = 1
+
+            keystate = pygame.key.get_pressed()
+            sim.trigger = keystate[pygame.K_SPACE]
+
+            if sim_thread:
+                for (mirror, joy) in zip(inputs, joysticks):
+                    mirror.copy_from(joy)
+            else:
+                # Only the last of the steps run for this frame is drawn
+                steps = 0
+                start = time.perf_counter()
+                while not (replay and replay.done):
+                    if replay:
+                        try:
+                            replay.apply(sim, my_joystick, sim_clock)
+                        except ValueError as e:
+                            raise SystemExit(e)
+                    sim.step()
+                    steps += 1
+                    if speed is None:
+                        if time.perf_counter() - start >= TURBO_BUDGET:
+                            break
+                    elif steps >= speed:
+                        break
+                if not steps:
+                    break  # The end of the replay
+                snapshots.publish(sim.snapshot())
+
+            snap = snapshots.latest()
+
+            # Decorate the game window
+            caption = "FPS: %.2f" % (clock.get_fps())
+            if sim_thread:
+                caption = caption + "  Sim: %.2f" % sim_thread.rate
+            if speed != 1:
+                caption = caption + "  >> %s" % ("%dx" % speed if speed else "max")
+            if snap.easter_egg:
+                caption = caption + "  -  Get the LS3s!"
+            pygame.display.set_caption(caption)
+
+            renderer.render(snap)
+
+            pygame.display.flip()
+            if recorder:
+                recorder.capture(screen)
+            clock.tick(FPS if paced else 0)
+
+        print(sim.lasers)
 
 # call the "main" function if running this script
 if __name__ == '__main__': main()
@@ -0,0 +1,305 @@
+'''
+A vectorized, Gym-style environment for the WildCat driving simulator.
+
+WildCatVecEnv steps N independent worlds at once, each with a WildCat and LS3s (the
+game's easter egg mode).  All the worlds are stepped together with NumPy, so there is no
+window, joystick or per-robot Python loop involved:
+
+    env = WildCatVecEnv(256, seed=0)
+    obs = env.reset()
+    obs, reward, terminated, truncated, info = env.step(actions)
+
+Actions replace the joystick: one row per world holding the x, y and rz stick axes in
+[-1, 1] (the same values the joystick reports) and a fire button (fires when > 0.5).
+The dynamics mirror the game: the steering chain, robot motion, LS3 random walk,
+lasers and collisions use the same constants, at a fixed frame time of 1 / FPS.  The
+game tests collisions against the LS3s' pixel masks, while the env treats LS3s as their
+image rectangles, so it also scores the hits and crashes that clip an image's
+transparent corners.
+
+Rewards are HIT_REWARD for each LS3 shot and CRASH_REWARD for driving into one, which
+also ends the episode.  Finished worlds are reset automatically; like Gym's vector envs,
+the last observation of their episodes is returned in info['final_observation'], with
+info['_final_observation'] marking the worlds that finished.
+
+    python wildcat_env.py --envs 1024 --steps 2000
+'''
+import argparse
+import math
+import time
+
+import numpy as np
+
+from wildcat_driving_helpers import *
+from wildcat_driving_tester import (WildCat, Laser, FPS, PIXELS_PER_METER, SCREEN_WIDTH, SCREEN_HEIGHT,
+                                    LS3_ODDS, LS3_RELOAD, MAX_SHOTS)
+
+
+LS3_SIZE = (65 / PIXELS_PER_METER, 46 / PIXELS_PER_METER)  # m, the size of the LS3 images
+LS3_STEP = 10.4 / FPS                                       # m, random walk step per frame
+
+
+class WildCatVecEnv:
+    MAX_LS3 = 16      # LS3s per world
+    N_NEAREST = 4     # LS3s included in the observation
+    HIT_REWARD = 1.0
+    CRASH_REWARD = -10.0
+    # x, y, cos(yaw), sin(yaw), xd_d, yd_d, rzd_d, ready to fire, lasers in flight, and
+    # (dx, dy, present) for each of the nearest LS3s in the robot's frame
+    OBS_SIZE = 9 + 3 * N_NEAREST
+
+    def __init__(self, n_envs, world_size=(SCREEN_WIDTH / PIXELS_PER_METER, SCREEN_HEIGHT / PIXELS_PER_METER),
+                 max_steps=int(60 * FPS), seed=None):
+        self.n_envs = n_envs
+        self.world_size = np.array(world_size, dtype=np.float64)
+        self.view_size = np.array((SCREEN_WIDTH, SCREEN_HEIGHT), dtype=np.float64) / PIXELS_PER_METER
+        self.max_steps = max_steps
+        self.dt = 1.0 / FPS
+        self._rng = np.random.default_rng(seed)
+
+        n = n_envs
+        self._xd = VecXdSteering(n, *WildCat.XD_LIMITS)
+        self._yd = VecYdSteering(n, *WildCat.YD_LIMITS)
+        self._rzd = VecRzdSteering(n, *WildCat.RZD_LIMITS)
+        self._xd.set_filter_params(self.dt, *WildCat.XD_FILTER)
+        self._rzd.set_filter_params(self.dt, *WildCat.RZD_FILTER)
+
+        self._pos = np.zeros((n, 2))
+        self._yaw = np.zeros(n)
+        self._reload = np.zeros(n)
+        self._steps = np.zeros(n, dtype=np.int64)
+        self._ls3_reload = np.zeros(n, dtype=np.int64)
+
+        self._ls3_alive = np.zeros((n, self.MAX_LS3), dtype=bool)
+        self._ls3_pos = np.zeros((n, self.MAX_LS3, 2))
+        self._ls3_walk = np.zeros((n, self.MAX_LS3, 2))
+        walk_filter = Filter2ndOrder(self.dt, 0.05)
+        self._ls3_filter = VecFilter2ndOrder(walk_filter, (n, self.MAX_LS3, 2))
+
+        # A world holds a single robot, so its MAX_SHOTS laser slots are the game's per robot limit
+        self._laser_alive = np.zeros((n, MAX_SHOTS), dtype=bool)
+        self._laser_pos = np.zeros((n, MAX_SHOTS, 2))
+        self._laser_vel = np.zeros((n, MAX_SHOTS, 2))
+        self._laser_age = np.zeros((n, MAX_SHOTS))
+
+        # The outline of the robot base in meters, in the robot's frame (see WildCat.outline)
+        (l, w) = (WildCat.DIMS[0] / PIXELS_PER_METER, WildCat.DIMS[1] / PIXELS_PER_METER)
+        self._outline = np.array([[0.5 * l, 0.5 * w], [-0.5 * l, 0.5 * w], [-0.5 * l, -0.5 * w],
+                                  [0.5 * l, -0.5 * w], [0.5 * l + 0.5 * w, 0]])
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self._rng = np.random.default_rng(seed)
+        self._reset(np.ones(self.n_envs, dtype=bool))
+        return self._observe()
+
+    def _reset(self, mask):
+        self._pos[mask] = 0.5 * self.world_size
+        self._yaw[mask] = -math.pi / 2
+        self._reload[mask] = WildCat.RELOAD_TIME
+        self._steps[mask] = 0
+        self._ls3_reload[mask] = LS3_RELOAD
+        for steering in (self._xd, self._yd, self._rzd):
+            steering.reset(0.0, mask)
+        self._ls3_alive[mask] = False
+        self._laser_alive[mask] = False
+
+    def step(self, actions):
+        '''
+        Step every world by one frame.  'actions' is an (n_envs, 4) array of the x, y and
+        rz stick axes and the fire button.  Returns (obs, reward, terminated, truncated,
+        info); worlds that finished have already been reset in 'obs'.  When any world
+        finished, info['final_observation'] holds every world's observation from before
+        the reset, which is needed to bootstrap the value of truncated episodes, and
+        info['_final_observation'] marks the worlds it applies to.
+        '''
+        actions = np.asarray(actions, dtype=np.float64)
+        dt = self.dt
+        reward = np.zeros(self.n_envs)
+
+        self._spawn_ls3s()
+        self._fire(actions[:, 3] > 0.5)
+
+        # The WildCat: steering, then motion in the world
+        axes = np.clip(actions[:, :3], -1.0, 1.0)
+        xd_d = self._xd.update(WildCat.XVEL_SCALE * vec_deadband(axes[:, 0], -WildCat.DBAND, WildCat.DBAND), dt)
+        yd_d = self._yd.update(WildCat.YVEL_SCALE * vec_deadband(axes[:, 1], -WildCat.YDDBAND, WildCat.YDDBAND), dt)
+        rzd_d = self._rzd.update(WildCat.RZD_SCALE * vec_deadband(axes[:, 2], -WildCat.DBAND, WildCat.DBAND), xd_d, dt)
+        self._yaw += rzd_d * dt
+        (c, s) = (np.cos(self._yaw), np.sin(self._yaw))
+        self._pos[:, 0] += (c * xd_d - s * yd_d) * dt
+        self._pos[:, 1] += (s * xd_d + c * yd_d) * dt
+        np.clip(self._pos, 0.0, self.world_size, out=self._pos)
+        self._reload -= dt
+
+        self._update_ls3s()
+        self._update_lasers()
+
+        reward += self.HIT_REWARD * self._laser_hits()
+        terminated = self._crashes()
+        reward[terminated] += self.CRASH_REWARD
+
+        self._steps += 1
+        truncated = ~terminated & (self._steps >= self.max_steps)
+        done = terminated | truncated
+        obs = self._observe()
+        info = {}
+        if done.any():
+            info['final_observation'] = obs
+            info['_final_observation'] = done
+            self._reset(done)
+            obs = self._observe()
+
+        return obs, reward, terminated, truncated, info
+
+    def _view(self):
+        # The part of the world around each robot that the game would show (see Camera)
+        half = 0.5 * np.minimum(self.view_size, self.world_size)
+        center = np.clip(self._pos, half, self.world_size - half)
+        return (center - half, center + half)
+
+    def _spawn_ls3s(self):
+        # Like the game's easter egg mode: after LS3_RELOAD frames each frame has a
+        # 1 in LS3_ODDS chance of a new LS3 somewhere in view.
+        counting = self._ls3_reload > 0
+        self._ls3_reload[counting] -= 1
+        free = ~self._ls3_alive
+        spawn = ~counting & (self._rng.random(self.n_envs) * LS3_ODDS < 1) & free.any(axis=1)
+        if not spawn.any():
+            return
+        envs = np.flatnonzero(spawn)
+        slots = np.argmax(free[envs], axis=1)
+        (lo, hi) = self._view()
+        pos = self._rng.uniform(lo[envs], hi[envs])
+        self._ls3_alive[envs, slots] = True
+        self._ls3_pos[envs, slots] = pos
+        self._ls3_walk[envs, slots] = pos
+        reset = np.zeros(self._ls3_alive.shape, dtype=bool)
+        reset[envs, slots] = True
+        self._ls3_filter.reset(reset)
+        self._ls3_reload[envs] = LS3_RELOAD
+
+    def _fire(self, fire):
+        free = ~self._laser_alive
+        fire = fire & (self._reload < 0) & free.any(axis=1)
+        if not fire.any():
+            return
+        envs = np.flatnonzero(fire)
+        slots = np.argmax(free[envs], axis=1)
+        yaw = self._yaw[envs]
+        speed = Laser.LASER_VEL[0]
+        self._laser_alive[envs, slots] = True
+        self._laser_pos[envs, slots] = self._pos[envs]
+        self._laser_vel[envs, slots] = np.column_stack((np.cos(yaw), np.sin(yaw))) * speed
+        self._laser_age[envs, slots] = 0.0
+        self._reload[envs] = WildCat.RELOAD_TIME
+
+    def _update_ls3s(self):
+        steps = self._rng.choice((-LS3_STEP, LS3_STEP), size=self._ls3_walk.shape)
+        self._ls3_walk += steps
+        pos = self._ls3_filter.filter_val(self._ls3_walk)
+        half = 0.5 * np.array(LS3_SIZE)
+        self._ls3_pos = np.where(self._ls3_alive[..., None], np.clip(pos, half, self.world_size - half), self._ls3_pos)
+
+    def _update_lasers(self):
+        alive = self._laser_alive
+        self._laser_age[alive] += self.dt
+        self._laser_pos[alive] += self._laser_vel[alive] * self.dt
+        inside = np.all((self._laser_pos >= 0) & (self._laser_pos <= self.world_size), axis=-1)
+        self._laser_alive &= inside & (self._laser_age <= Laser.MAX_AGE)
+
+    def _laser_hits(self):
+        # Lasers hit LS3s whose image rect contains the laser's position.  The game also
+        # checks the LS3's mask there (see Laser.check_collision).
+        delta = self._laser_pos[:, :, None, :] - self._ls3_pos[:, None, :, :]
+        half = 0.5 * np.array(LS3_SIZE)
+        hit = np.all(np.abs(delta) <= half, axis=-1)
+        hit &= self._laser_alive[:, :, None] & self._ls3_alive[:, None, :]
+        if not hit.any():
+            return np.zeros(self.n_envs)
+        # Like spritecollide, a laser destroys every LS3 it touches
+        destroyed = hit.any(axis=1)
+        self._laser_alive &= ~hit.any(axis=2)
+        self._ls3_alive &= ~destroyed
+        return destroyed.sum(axis=1).astype(np.float64)
+
+    def _crashes(self):
+        # The robot's outline, a convex polygon, against the LS3 image rects.  The game tests
+        # the outline against the LS3's mask (see WildCat.check_collision).  The shapes
+        # overlap unless an axis of the rects or an edge normal of the outline separates them.
+        (c, s) = (np.cos(self._yaw)[:, None], np.sin(self._yaw)[:, None])
+        (ox, oy) = (self._outline[:, 0], self._outline[:, 1])
+        xs = c * ox - s * oy  # (n_envs, corner), relative to the robot
+        ys = s * ox + c * oy
+        half = 0.5 * np.array(LS3_SIZE)
+        delta = self._ls3_pos - self._pos[:, None, :]  # (n_envs, LS3, xy)
+        crash = ((delta[..., 0] + half[0] >= xs.min(axis=1)[:, None]) &
+                 (delta[..., 0] - half[0] <= xs.max(axis=1)[:, None]) &
+                 (delta[..., 1] + half[1] >= ys.min(axis=1)[:, None]) &
+                 (delta[..., 1] - half[1] <= ys.max(axis=1)[:, None]))
+
+        (nx, ny) = (ys - np.roll(ys, -1, axis=1), np.roll(xs, -1, axis=1) - xs)  # (n_envs, edge)
+        proj = nx[:, :, None] * xs[:, None, :] + ny[:, :, None] * ys[:, None, :]  # (n_envs, edge, corner)
+        (lo, hi) = (proj.min(axis=2)[:, None, :], proj.max(axis=2)[:, None, :])
+        center = delta[..., 0, None] * nx[:, None, :] + delta[..., 1, None] * ny[:, None, :]
+        radius = half[0] * np.abs(nx)[:, None, :] + half[1] * np.abs(ny)[:, None, :]
+        crash &= np.all((center + radius >= lo) & (center - radius <= hi), axis=-1)
+
+        crash &= self._ls3_alive
+        self._ls3_alive &= ~crash
+        return crash.any(axis=1)
+
+    def _observe(self):
+        obs = np.zeros((self.n_envs, self.OBS_SIZE), dtype=np.float32)
+        (c, s) = (np.cos(self._yaw), np.sin(self._yaw))
+        obs[:, 0:2] = self._pos
+        obs[:, 2] = c
+        obs[:, 3] = s
+        obs[:, 4] = self._xd.cmd_d
+        obs[:, 5] = self._yd.cmd_d
+        obs[:, 6] = self._rzd.cmd_d
+        obs[:, 7] = self._reload < 0
+        obs[:, 8] = self._laser_alive.sum(axis=1) / MAX_SHOTS
+
+        delta = self._ls3_pos - self._pos[:, None, :]
+        dist = np.where(self._ls3_alive, np.hypot(delta[..., 0], delta[..., 1]), np.inf)
+        nearest = np.argsort(dist, axis=1)[:, :self.N_NEAREST]
+        rows = np.arange(self.n_envs)[:, None]
+        d = delta[rows, nearest]
+        present = np.isfinite(dist[rows, nearest])
+        # Into the robot's frame
+        dx = c[:, None] * d[..., 0] + s[:, None] * d[..., 1]
+        dy = -s[:, None] * d[..., 0] + c[:, None] * d[..., 1]
+        obs[:, 9::3] = np.where(present, dx, 0.0)
+        obs[:, 10::3] = np.where(present, dy, 0.0)
+        obs[:, 11::3] = present
+        return obs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of WildCatVecEnv.")
+    parser.add_argument('--envs', type=int, default=1024, help="number of worlds stepped together")
+    parser.add_argument('--steps', type=int, default=1000, help="number of batch steps")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    env = WildCatVecEnv(args.envs, seed=args.seed)
+    env.reset()
+    rng = np.random.default_rng(args.seed)
+    actions = rng.uniform(-1, 1, (args.steps, args.envs, 4))
+
+    total = 0.0
+    crashes = 0
+    start = time.perf_counter()
+    for a in actions:
+        (obs, reward, terminated, truncated, info) = env.step(a)
+        total += reward.sum()
+        crashes += terminated.sum()
+    elapsed = time.perf_counter() - start
+
+    print("%d worlds x %d steps in %.2f s: %.0f env steps/s" % (args.envs, args.steps, elapsed,
+                                                               args.envs * args.steps / elapsed))
+    print("total reward %.1f, %d crashes" % (total, crashes))
+
+
+if __name__ == '__main__': main()
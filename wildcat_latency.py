@@ -0,0 +1,197 @@
+'''
+Input-to-display latency harness for the WildCat driving simulator.
+
+Synthetic step inputs are injected through a scripted joystick and every frame is
+timestamped as it passes through the pipeline:
+
+    input  - first joystick axis read of the frame
+    steer  - the steering chain has produced new xd_d/yd_d/rzd_d values
+    draw   - the snapshot of the world, the graphs and the HUD have been drawn
+    flip   - pygame.display.flip() has returned
+
+For every step the number of frames until the commanded value visibly changes is
+recorded, along with the analytical group delay of the steering filters.
+
+Runs headless by default using SDL's dummy video driver:
+
+    python wildcat_latency.py --steps 20
+'''
+import argparse
+import os
+import time
+
+import numpy as np
+import pygame
+
+from wildcat_analysis import filter_group_delay
+from wildcat_driving_helpers import *
+from wildcat_driving_tester import Simulation, Renderer, WildCat, SteeringGraph, FPS, SCREEN_WIDTH, SCREEN_HEIGHT
+
+
+STAGES = ('input', 'steer', 'draw', 'flip')
+PERCENTILES = (0, 50, 95, 99, 100)
+
+
+class TimedJoystick(ScriptedJoystick):
+    '''
+    A scripted joystick that remembers when it was first read after 'new_frame()'.
+    '''
+    def __init__(self):
+        ScriptedJoystick.__init__(self, "Latency harness joystick")
+        self.first_read = None
+
+    def new_frame(self):
+        self.first_read = None
+
+    def get_axis(self, axis):
+        if self.first_read is None:
+            self.first_read = time.perf_counter()
+        return ScriptedJoystick.get_axis(self, axis)
+
+
+def _stamp_after(func, stamps, stage):
+    # Wrap 'func' so that the time it returns is recorded as 'stage' in 'stamps'
+    def wrapper(*args, **kwargs):
+        out = func(*args, **kwargs)
+        stamps[stage] = time.perf_counter()
+        return out
+    return wrapper
+
+
+class LatencyHarness:
+    # Joystick axis and deflection used to excite each steering axis
+    STEP_AXES = {'xd': (JOYSTICK_CFG.X_AXIS, -0.8),
+                 'rzd': (JOYSTICK_CFG.RZ_AXIS, 0.8)}
+
+    def __init__(self, n_steps=10, hold_frames=120, threshold=0.1, paced=False):
+        self._n_steps = n_steps
+        self._hold_frames = hold_frames
+        self._threshold = threshold
+        self._paced = paced
+
+        self._stamps = {}
+        self._frames = []     # One dict of stage timestamps per frame
+        self._responses = {}  # Per axis: list of (frames, seconds) until a visible change
+
+    def run(self, headless=True):
+        if headless:
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+        pygame.init()
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT + WildCat.N_GRAPHS * SteeringGraph.GRAPH_HEIGHT))
+
+        joystick = TimedJoystick()
+        joystick.init()
+        sim = Simulation([joystick], FixedStepClock(1.0 / FPS))
+        renderer = Renderer(screen)
+        renderer.render = _stamp_after(renderer.render, self._stamps, 'draw')
+        # process_joystick ends with the last of the three steering updates in a frame.
+        wildcat = sim.wildcat
+        wildcat.process_joystick = _stamp_after(wildcat.process_joystick, self._stamps, 'steer')
+
+        pacer = pygame.time.Clock()
+        try:
+            for name in self.STEP_AXES:
+                self._responses[name] = []
+                for step in range(self._n_steps):
+                    self._run_step(name, step, sim, renderer, joystick, pacer, FPS)
+        finally:
+            pygame.quit()
+
+        return self.results(1.0 / FPS, sim.wildcat)
+
+    def _run_step(self, name, step, sim, renderer, joystick, pacer, fps):
+        axis, deflection = self.STEP_AXES[name]
+        steering = sim.wildcat.xd_steering if name == 'xd' else sim.wildcat.rzd_steering
+        joystick.set_axis(axis, deflection if step % 2 == 0 else 0.0)
+
+        cmd_start = steering.cmd_d
+        t_inject = None
+        visible = None
+        for frame in range(self._hold_frames):
+            joystick.new_frame()
+            self._stamps.clear()
+
+            sim.step()
+            renderer.render(sim.snapshot())
+            pygame.event.pump()
+            pygame.display.flip()
+            self._stamps['flip'] = time.perf_counter()
+            self._stamps['input'] = joystick.first_read
+            self._frames.append(dict(self._stamps))
+
+            if frame == 0:
+                t_inject = self._stamps['input']
+                # The size of the change we expect once the chain has settled
+                target = steering.cmd_req - cmd_start
+            if visible is None and abs(steering.cmd_d - cmd_start) >= self._threshold * abs(target) > 0:
+                visible = (frame, self._stamps['flip'] - t_inject)
+
+            if self._paced:
+                pacer.tick(fps)
+
+        # Return all axes to neutral before the next axis is exercised
+        if step == self._n_steps - 1:
+            joystick.set_axis(axis, 0.0)
+
+        if visible is not None:
+            self._responses[name].append(visible)
+
+    def results(self, dt, wildcat):
+        out = {'stages': {}, 'responses': {}, 'group_delay': {}}
+
+        stamps = {s: np.array([f[s] for f in self._frames]) for s in STAGES}
+        for prev, cur in zip(STAGES[:-1], STAGES[1:]):
+            out['stages'][prev + '->' + cur] = np.percentile(stamps[cur] - stamps[prev], PERCENTILES)
+        out['stages']['input->flip'] = np.percentile(stamps['flip'] - stamps['input'], PERCENTILES)
+
+        for name, resp in self._responses.items():
+            if not resp:
+                continue
+            frames = np.array([r[0] for r in resp])
+            out['responses'][name] = {'frames': np.percentile(frames, PERCENTILES),
+                                      'sim_time': np.percentile(frames * dt, PERCENTILES),
+                                      'wall_time': np.percentile([r[1] for r in resp], PERCENTILES)}
+
+        for name, steering in (('xd', wildcat.xd_steering), ('rzd', wildcat.rzd_steering)):
+            filt = steering._xd_filter if name == 'xd' else steering._rzd_filter
+            if filt:
+                out['group_delay'][name] = filter_group_delay(filt)
+
+        return out
+
+
+def print_results(results):
+    header = "%-14s" % "" + "".join("%10s" % ("p%d" % p) for p in PERCENTILES)
+    print("Per-stage latency (ms)")
+    print(header)
+    for stage, pct in results['stages'].items():
+        print("%-14s" % stage + "".join("%10.3f" % (1000.0 * v) for v in pct))
+
+    print("\nStep input to visible change")
+    print(header)
+    for name, resp in results['responses'].items():
+        print("%-14s" % (name + " frames") + "".join("%10.1f" % v for v in resp['frames']))
+        print("%-14s" % (name + " sim ms") + "".join("%10.1f" % (1000.0 * v) for v in resp['sim_time']))
+        print("%-14s" % (name + " wall ms") + "".join("%10.3f" % (1000.0 * v) for v in resp['wall_time']))
+
+    print("\nFilter group delay at DC (ms)")
+    for name, delay in results['group_delay'].items():
+        print("%-14s%10.1f" % (name, 1000.0 * delay))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure WildCat input-to-display latency.")
+    parser.add_argument('--steps', type=int, default=10, help="number of step inputs per axis")
+    parser.add_argument('--hold', type=int, default=120, help="frames to hold each step")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="fraction of the step at which the change counts as visible")
+    parser.add_argument('--paced', action='store_true', help="pace frames at the game's FPS")
+    parser.add_argument('--window', action='store_true', help="open a real window instead of running headless")
+    args = parser.parse_args()
+
+    harness = LatencyHarness(args.steps, args.hold, args.threshold, args.paced)
+    print_results(harness.run(headless=not args.window))
+
+
+if __name__ == '__main__': main()
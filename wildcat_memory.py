@@ -0,0 +1,159 @@
+'''
+Memory footprint benchmark for the WildCat driving simulator.
+
+Reports the bytes allocated per LS3, laser, steering processor and filter (measured with
+tracemalloc), and the peak RSS of a process holding 1k, 10k and 100k LS3s.  Every LS3
+count is measured in a fresh process, so one count's peak doesn't hide the next:
+
+    python wildcat_memory.py
+    python wildcat_memory.py --counts 1000 10000 --budget 1500
+
+With --budget, the exit status is 1 when an LS3 takes more than that many bytes, so the
+benchmark can catch memory regressions.
+'''
+import argparse
+import gc
+import multiprocessing
+import os
+import random
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_COUNTS = (1000, 10000, 100000)
+N_SAMPLES = 2000  # Objects created to measure the bytes per object
+
+
+def _setup():
+    # Sprites need a display to load their images, and a Simulation for their groups
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import wildcat_driving_tester as game
+    from wildcat_driving_helpers import ScriptedJoystick, FixedStepClock
+
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    img = game.load_images('LS3_FLHR_small.png', 'LS3_FRHL_small.png')
+    game.LS3.images = img + [pygame.transform.flip(im, 1, 0) for im in img]
+    game.LS3.masks = game.load_masks(game.LS3.images)
+    random.seed(0)
+    return game.Simulation([ScriptedJoystick()], FixedStepClock(1.0 / game.FPS))
+
+
+def _random_point():
+    import wildcat_driving_tester as game
+    return (random.randint(game.WORLDRECT.left, game.WORLDRECT.right),
+            random.randint(game.WORLDRECT.top, game.WORLDRECT.bottom))
+
+
+def bytes_per_object(make, n=N_SAMPLES):
+    ''' The average number of bytes allocated by 'make()', over 'n' objects. '''
+    objs = [None] * n
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(n):
+        objs[i] = make()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / n
+
+
+def entity_sizes(n=N_SAMPLES):
+    ''' Bytes per object of each kind of entity, averaged over 'n' of each, as a dict. '''
+    import wildcat_driving_tester as game
+    from wildcat_driving_helpers import XdSteering, Filter2ndOrder
+
+    sim = _setup()
+    dt = 1.0 / game.FPS
+
+    def ls3():
+        # An LS3 that has been updated, so its filters have state
+        s = game.LS3(_random_point())
+        s.update()
+        return s
+
+    def xd_steering():
+        s = XdSteering(*game.WildCat.XD_LIMITS)
+        s.set_filter_params(dt, *game.WildCat.XD_FILTER)
+        s.update(1.0, dt)
+        return s
+
+    def filt():
+        f = Filter2ndOrder(dt, 0.05)
+        f.filter_val(1.0)
+        return f
+
+    return {'LS3': bytes_per_object(ls3, n),
+            'Laser': bytes_per_object(lambda: game.Laser(sim.wildcat, sim.clock), n),
+            'XdSteering': bytes_per_object(xd_steering, n),
+            'Filter2ndOrder': bytes_per_object(filt, n)}
+
+
+def _max_rss():
+    # Peak resident set size of this process in bytes
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def ls3_peak_rss(n):
+    ''' (peak RSS before, peak RSS after) creating and updating 'n' LS3s, in bytes. '''
+    import wildcat_driving_tester as game
+
+    _setup()
+    before = _max_rss()
+    ls3s = [game.LS3(_random_point()) for _ in range(n)]
+    for s in ls3s:
+        s.update()
+    return (before, _max_rss())
+
+
+def _call(queue, func, args):
+    queue.put(func(*args))
+
+
+def run_isolated(func, *args):
+    ''' Call 'func(*args)' in a fresh process and return the result. '''
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.SimpleQueue()
+    proc = ctx.Process(target=_call, args=(queue, func, args))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory footprint of the simulator's entities.")
+    parser.add_argument('--counts', type=int, nargs='+', default=DEFAULT_COUNTS,
+                        help="numbers of LS3s to measure the peak RSS at")
+    parser.add_argument('--samples', type=int, default=N_SAMPLES, help="objects created to measure each size")
+    parser.add_argument('--budget', type=float, help="fail if an LS3 takes more than this many bytes")
+    args = parser.parse_args()
+
+    sizes = run_isolated(entity_sizes, args.samples)
+    print("%-16s %10s" % ("entity", "bytes"))
+    for (name, size) in sizes.items():
+        print("%-16s %10.0f" % (name, size))
+
+    if resource is None:
+        print("\nPeak RSS isn't available on this platform.")
+    else:
+        print("\n%10s %14s %14s %12s" % ("LS3s", "peak RSS MB", "increase MB", "bytes/LS3"))
+        for n in args.counts:
+            (before, after) = run_isolated(ls3_peak_rss, n)
+            print("%10d %14.1f %14.1f %12.0f" % (n, after / 2 ** 20, (after - before) / 2 ** 20, (after - before) / n))
+
+    if args.budget is not None and sizes['LS3'] > args.budget:
+        print("\nAn LS3 takes %.0f bytes, over the budget of %.0f." % (sizes['LS3'], args.budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,414 @@
+'''
+Per-frame steering telemetry for the WildCat driving simulator.
+
+The game publishes one TELEMETRY_DTYPE record per frame into a TelemetryRing, a ring
+buffer that lives in a multiprocessing.shared_memory block.  Publishing a frame is a
+single structured-array assignment, so the game loop doesn't pay for plotting.  A
+separate plotter process (see 'run_plotter') attaches to the same block by name and
+draws the traces in its own window, at its own rate:
+
+    python wildcat_driving_tester.py --telemetry
+
+The same records can be saved for a whole session with a TelemetryLogger, which fills
+preallocated chunks and writes each full chunk as a .npy file from a background thread.
+Read a session back with 'open_telemetry' (memory mapped chunks) or 'read_telemetry',
+or play it back in the game with a SessionReplay:
+
+    python wildcat_driving_tester.py --log runs/session1
+    python wildcat_driving_tester.py --replay runs/session1
+'''
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from wildcat_driving_helpers import JOYSTICK_CFG
+
+
+STEERING_AXES = ('xd', 'yd', 'rzd')
+STEERING_FIELDS = ('req', 'd_unfilt', 'd')
+
+# Besides the steering state each record holds the inputs of its frame (the clock time in
+# ms, the raw joystick axes and the fire and easter egg flags) so sessions can be replayed.
+TELEMETRY_DTYPE = np.dtype([('frame', np.int64), ('t', np.float64), ('clock_ms', np.float64),
+                            ('ax_x', np.float64), ('ax_y', np.float64), ('ax_rz', np.float64),
+                            ('fire', np.uint8), ('egg', np.uint8),
+                            ('x', np.float32), ('y', np.float32), ('yaw', np.float32)] +
+                           [(a + '_' + f, np.float32) for a in STEERING_AXES for f in STEERING_FIELDS])
+
+# Version of the game that logged sessions are replayed in.  Bump it whenever a change
+# makes old sessions play out differently (their random numbers or update order), so
+# SessionReplay rejects them instead of replaying something else.
+LOG_FORMAT = 2
+
+# The ring header: total records written, ring capacity and a 'writer is running' flag
+_HEADER_DTYPE = np.dtype([('count', np.int64), ('capacity', np.int64), ('running', np.int64)])
+
+
+def telemetry_row(sim):
+    '''
+    Pack the latest step of the Simulation 'sim' into a tuple matching TELEMETRY_DTYPE.
+    With several robots, the first one is recorded.
+    '''
+    wildcat = sim.wildcat
+    xd, yd, rzd = wildcat.xd_steering, wildcat.yd_steering, wildcat.rzd_steering
+    return (sim.frame, sim.time, sim.clock.get_time()) + wildcat.axes + (sim.fired[0], sim.easter_egg,
+            wildcat.pos[0], wildcat.pos[1], wildcat.yaw,
+            xd.cmd_req, xd.cmd_d_unfilt, xd.cmd_d,
+            yd.cmd_req, yd.cmd_d_unfilt, yd.cmd_d,
+            rzd.cmd_req, rzd.cmd_d_unfilt, rzd.cmd_d)
+
+
+def attach_shared_memory(name):
+    # Readers shouldn't register the block with the resource tracker, otherwise the
+    # tracker unlinks it when the reader exits (only configurable from Python 3.13).
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class TelemetryRing:
+    '''
+    A single-writer, multi-reader ring buffer of TELEMETRY_DTYPE records in shared memory.
+
+    Create it in the game with 'TelemetryRing(capacity)' and attach to it from another
+    process with 'TelemetryRing.attach(ring.name)'.
+    '''
+    def __init__(self, capacity=4096, name=None, _shm=None):
+        if _shm is None:
+            if capacity <= 0:
+                raise ValueError("Value of 'capacity' must be greater than 0.")
+            size = _HEADER_DTYPE.itemsize + capacity * TELEMETRY_DTYPE.itemsize
+            _shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._owner = True
+        else:
+            self._owner = False
+
+        self._shm = _shm
+        self._header = np.ndarray((), _HEADER_DTYPE, buffer=_shm.buf)
+        if self._owner:
+            self._header['count'] = 0
+            self._header['capacity'] = capacity
+            self._header['running'] = 1
+        self._capacity = int(self._header['capacity'])
+        self._data = np.ndarray((self._capacity,), TELEMETRY_DTYPE, buffer=_shm.buf,
+                                offset=_HEADER_DTYPE.itemsize)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_shm=attach_shared_memory(name))
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        return int(self._header['count'])
+
+    @property
+    def running(self):
+        return bool(self._header['running'])
+
+    def push(self, row):
+        ''' Append one record (a TELEMETRY_DTYPE tuple or record), overwriting the oldest. '''
+        count = int(self._header['count'])
+        self._data[count % self._capacity] = row
+        # Only publish the record once it has been completely written.
+        self._header['count'] = count + 1
+
+    def read_since(self, last):
+        '''
+        Return (records, count) with every record written since a previous call returned
+        'last'.  Records that have already been overwritten are skipped.
+        '''
+        count = int(self._header['count'])
+        first = max(last, count - self._capacity)
+        idx = np.arange(first, count) % self._capacity
+        records = self._data[idx]  # Fancy indexing copies
+
+        # The writer may have lapped us while copying; drop anything it overwrote.  The slot
+        # of the next record is written before the count is published, so that record may
+        # be torn as well.
+        overwritten = int(self._header['count']) + 1 - self._capacity - first
+        if overwritten > 0:
+            records = records[overwritten:]
+        return records, count
+
+    def close(self):
+        if self._owner:
+            self._header['running'] = 0
+        # Release our views of the buffer before closing it
+        self._header = self._data = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def run_plotter(name, width=800, panel_height=150, fps=30):
+    '''
+    Plot the telemetry published to the TelemetryRing called 'name' until either the
+    window is closed or the writer shuts the ring down.
+    '''
+    import pygame
+
+    ring = TelemetryRing.attach(name)
+    colors = ((50, 50, 255), (0xBF, 0x0F, 0xB5), (255, 0, 0))
+    traces = {f: deque([], width) for f in TELEMETRY_DTYPE.names}
+    n_panels = len(STEERING_AXES) + 1
+
+    pygame.init()
+    screen = pygame.display.set_mode((width, n_panels * panel_height))
+    pygame.display.set_caption('WildCat telemetry')
+    font = pygame.font.Font(None, 20)
+    clock = pygame.time.Clock()
+
+    last = 0
+    done = False
+    while not done and ring.running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                done = True
+
+        records, last = ring.read_since(last)
+        for f in TELEMETRY_DTYPE.names:
+            traces[f].extend(records[f].tolist())
+
+        screen.fill((255, 255, 255))
+        for i, axis in enumerate(STEERING_AXES):
+            panel = screen.subsurface((0, i * panel_height, width, panel_height))
+            names = [axis + '_' + f for f in STEERING_FIELDS]
+            _draw_panel(panel, [traces[n] for n in names], names, colors, font)
+        panel = screen.subsurface((0, len(STEERING_AXES) * panel_height, width, panel_height))
+        _draw_panel(panel, [traces['x'], traces['y'], traces['yaw']], ['x', 'y', 'yaw'], colors, font)
+
+        pygame.display.flip()
+        clock.tick(fps)
+
+    ring.close()
+    pygame.quit()
+
+
+def _draw_panel(surface, traces, names, colors, font):
+    import pygame
+
+    pygame.draw.rect(surface, (0, 0, 0), surface.get_rect(), 2)
+    if len(traces[0]) < 2:
+        return
+    arrays = [np.asarray(t, dtype=np.float32) for t in traces]
+    lo = min(a.min() for a in arrays)
+    hi = max(a.max() for a in arrays)
+    span = max(hi - lo, 1e-3)
+    h = surface.get_height() - 4
+    x = np.arange(len(arrays[0]))
+    for a, name, color in zip(arrays, names, colors):
+        y = 2 + h - (a - lo) * (h / span)
+        pygame.draw.lines(surface, color, False, np.column_stack((x, y)).tolist(), 2)
+    for i, (name, color) in enumerate(zip(names, colors)):
+        surface.blit(font.render(name, 1, color), (10, 6 + 16 * i))
+
+
+def start_plotter(ring, **kwargs):
+    '''
+    Start 'run_plotter' for 'ring' in a new process.  The process is spawned rather than
+    forked so that it gets its own, independent SDL state.
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    proc = ctx.Process(target=run_plotter, args=(ring.name,), kwargs=kwargs, daemon=True)
+    proc.start()
+    return proc
+
+
+_CHUNK_PATTERN = 'chunk_%06d.npy'
+_META_FILE = 'meta.json'
+
+
+class TelemetryLogger:
+    '''
+    Logs TELEMETRY_DTYPE records to the directory 'path' as a series of .npy chunks.
+
+    'log' only copies the record into a preallocated chunk.  Full chunks are handed to
+    a writer thread, and the chunk buffers are recycled once they've been written, so
+    long sessions neither allocate nor touch the disk from the game loop.  If writing a
+    chunk fails, the error is raised from the next 'log' or 'close'.  Each session
+    needs a directory of its own, so 'path' must not hold a logged session already.
+    '''
+    def __init__(self, path, chunk_size=4096, n_buffers=4, meta=None):
+        if chunk_size <= 0:
+            raise ValueError("Value of 'chunk_size' must be greater than 0.")
+        if glob.glob(os.path.join(path, 'chunk_*.npy')):
+            raise FileExistsError("'%s' already holds a logged session." % path)
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._chunk_size = chunk_size
+        self._next_chunk = 0
+
+        info = {'dtype': TELEMETRY_DTYPE.descr, 'chunk_size': chunk_size, 'created': time.time(),
+                'format': LOG_FORMAT}
+        info.update(meta or {})
+        with open(os.path.join(path, _META_FILE), 'w') as f:
+            json.dump(info, f, indent=2)
+
+        self._free = queue.Queue()
+        for _ in range(n_buffers - 1):
+            self._free.put(np.empty(chunk_size, TELEMETRY_DTYPE))
+        self._buf = np.empty(chunk_size, TELEMETRY_DTYPE)
+        self._n = 0
+
+        self._pending = queue.Queue()
+        self._error = None  # The exception that stopped the writer thread
+        self._writer = threading.Thread(target=self._write_loop, name='TelemetryLogger', daemon=True)
+        self._writer.start()
+
+    @property
+    def path(self):
+        return self._path
+
+    def log(self, row):
+        ''' Append one record (a TELEMETRY_DTYPE tuple or record). '''
+        self._buf[self._n] = row
+        self._n += 1
+        if self._n == self._chunk_size:
+            self._submit()
+
+    def flush(self):
+        ''' Hand the partially filled chunk to the writer thread. '''
+        if self._n:
+            self._submit()
+
+    def close(self):
+        ''' Write out everything logged so far and stop the writer thread. '''
+        try:
+            self.flush()
+        finally:
+            self._pending.put(None)
+            self._writer.join()
+        self._check()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _submit(self):
+        self._check()
+        self._pending.put((self._next_chunk, self._buf, self._n))
+        self._next_chunk += 1
+        try:
+            self._buf = self._free.get_nowait()
+        except queue.Empty:
+            # The writer has fallen behind; grow the pool rather than stall the frame.
+            self._buf = np.empty(self._chunk_size, TELEMETRY_DTYPE)
+        self._n = 0
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            (idx, buf, n) = item
+            fname = os.path.join(self._path, _CHUNK_PATTERN % idx)
+            try:
+                # Write to a temporary file first so readers never see a partial chunk
+                with open(fname + '.tmp', 'wb') as f:
+                    np.save(f, buf[:n])
+                os.replace(fname + '.tmp', fname)
+            except Exception as e:
+                # Stop writing; the game finds out the next time it submits a chunk
+                self._error = e
+                return
+            self._free.put(buf)
+
+
+def open_telemetry(path):
+    ''' Return the chunks of a logged session as a list of read-only memory maps. '''
+    files = sorted(glob.glob(os.path.join(path, 'chunk_*.npy')))
+    return [np.load(f, mmap_mode='r') for f in files]
+
+
+def read_telemetry(path, fields=None):
+    '''
+    Read a logged session into one array.  If 'fields' is given only those columns are
+    copied out of the memory mapped chunks.
+    '''
+    chunks = open_telemetry(path)
+    if fields is not None:
+        chunks = [c[list(fields)] for c in chunks]
+    if not chunks:
+        dtype = TELEMETRY_DTYPE if fields is None else TELEMETRY_DTYPE[list(fields)]
+        return np.empty(0, dtype)
+    return np.concatenate(chunks)
+
+
+def read_telemetry_meta(path):
+    with open(os.path.join(path, _META_FILE)) as f:
+        return json.load(f)
+
+
+class SessionReplay:
+    '''
+    Feeds the inputs recorded in a logged session back into a Simulation, one frame at a
+    time.  Together with the random seed stored in the session's metadata this reproduces
+    the recorded session exactly.  Raises ValueError for logs that can't be replayed.
+
+    A rewind shows up in the log as a frame that goes back to a checkpoint.  The replay
+    rewinds the simulation there too, which lands on the same checkpoint since everything
+    up to then has been reproduced.
+    '''
+    INPUT_FIELDS = ('frame', 'clock_ms', 'ax_x', 'ax_y', 'ax_rz', 'fire', 'egg')
+
+    def __init__(self, path):
+        chunks = open_telemetry(path)
+        names = chunks[0].dtype.names if chunks else ()
+        meta_file = os.path.join(path, _META_FILE)
+        self.meta = read_telemetry_meta(path) if os.path.exists(meta_file) else {}
+        if 'seed' not in self.meta or not set(self.INPUT_FIELDS) <= set(names):
+            raise ValueError("'%s' wasn't logged with the inputs needed to replay it." % path)
+        if self.meta.get('format') != LOG_FORMAT:
+            raise ValueError("'%s' was logged by another version of the game and can't be replayed." % path)
+
+        self._inputs = read_telemetry(path, self.INPUT_FIELDS)
+        frames = self._inputs['frame']
+        # Every frame follows the one before it, or goes back to a checkpoint
+        if len(frames) and (frames[0] != 0 or (np.diff(frames) > 1).any()):
+            raise ValueError("The frames logged in '%s' aren't a single session." % path)
+        self._next = 0  # The record that is applied next
+
+    def __len__(self):
+        return len(self._inputs)
+
+    @property
+    def done(self):
+        return self._next == len(self._inputs)
+
+    def apply(self, sim, joystick, clock):
+        '''
+        Set up the inputs for the next step of 'sim'.  'joystick' and 'clock' are the
+        ScriptedJoystick and FixedStepClock the simulation was created with.
+        '''
+        rec = self._inputs[self._next]
+        if rec['frame'] < sim.frame:
+            # The session was rewound before this step
+            sim.checkpoints.rewind(sim)
+        if rec['frame'] != sim.frame:
+            raise ValueError("The replay is at frame %d but the next logged frame is %d." %
+                             (sim.frame, rec['frame']))
+        self._next += 1
+        clock.set_time(float(rec['clock_ms']))
+        joystick.set_axis(JOYSTICK_CFG.X_AXIS, float(rec['ax_x']))
+        joystick.set_axis(JOYSTICK_CFG.Y_AXIS, float(rec['ax_y']))
+        joystick.set_axis(JOYSTICK_CFG.RZ_AXIS, float(rec['ax_rz']))
+        joystick.set_button(JOYSTICK_CFG.LBUMP, rec['fire'])
+        sim.trigger = False
+        sim.easter_egg = bool(rec['egg'])
@@ -3,8 +3,73 @@ import cmath
 import numpy as np
 
 
+class _FilterDesign:
+    '''
+    The discrete transfer function H(z) = B(z) / A(z) of a Filter2ndOrder and the
+    coefficients of its difference equation.  Designs are shared by every filter with the
+    same parameters, so a filter itself only holds its state.
+    '''
+    __slots__ = ('dt', 'A', 'B', 'cxn', 'cx0', 'cx1', 'cy0', 'cy1', '_held')
+
+    def __init__(self, dt, freq_hz, gain, q):
+        self.dt = dt
+
+        zeta = 1.0 / (2 * q)
+        w0   = freq_hz * 2 * math.pi
+        D    = zeta ** 2 - 1
+        s_poles = np.array((-w0 * (zeta + cmath.sqrt(D)), -w0 * (zeta - cmath.sqrt(D))), dtype=np.complex64)
+        s_zeros = np.array([], dtype=np.complex64)
+        s_gain = gain * w0 ** 2
+
+        # Convert to the z-domain with the bilinear transform
+        samp_freq = 1 / dt
+        z_zeros = [(1 + z * dt / 2) / (1 - z * dt / 2) for z in s_zeros]
+        z_poles = [(1 + p * dt / 2) / (1 - p * dt / 2) for p in s_poles]
+
+        g = complex(1, 0)
+        for z in s_zeros:
+            g *= 2 * samp_freq - z
+        for p in s_poles:
+            g /= 2 * samp_freq - p
+        z_gain = (g * s_gain).real
+
+        while len(z_zeros) < len(z_poles):
+            z_zeros.append(complex(-1, 0))
+
+        self.B = np.poly1d(z_gain * np.poly1d(z_zeros, True))
+        self.A = np.poly1d(z_poles, True)
+
+        # y[n] = cxn * x[n] + zi0, with the state updated by the remaining coefficients
+        (b, a) = (self.B.coeffs.real, self.A.coeffs.real)
+        self.cxn = float(b[0] / a[0])
+        (self.cx0, self.cx1) = (float(b[1] / a[0]), float(b[2] / a[0]))
+        (self.cy0, self.cy1) = (float(a[1] / a[0]), float(a[2] / a[0]))
+        self._held = {}
+
+    def held(self, steps):
+        '''
+        Coefficients that run the filter for 'steps' samples of the same input at once:
+        (F, H, C, k) where the state becomes F zi + H x and the last output is C zi + k x.
+        '''
+        coeffs = self._held.get(steps)
+        if coeffs is None:
+            # The difference equation as a state space model, zi' = F1 zi + G x
+            F1 = np.array(((-self.cy0, 1.0), (-self.cy1, 0.0)))
+            G = np.array((self.cx0 - self.cy0 * self.cxn, self.cx1 - self.cy1 * self.cxn))
+            (F, H) = (np.eye(2), np.zeros(2))
+            for _ in range(steps - 1):
+                (F, H) = (F1 @ F, F1 @ H + G)
+            (C, k) = (F[0], H[0] + self.cxn)
+            (F, H) = (F1 @ F, F1 @ H + G)
+            coeffs = self._held[steps] = (F.tolist(), H.tolist(), C.tolist(), float(k))
+        return coeffs
+
+
 # A basic 2nd order filtering class.
 class Filter2ndOrder:
+    __slots__ = ('_design', '_initialized', '_zi0', '_zi1')
+    _designs = {}  # (dt, freq_hz, gain, q): _FilterDesign
+
     def __init__(self, dt, freq_hz, gain=1, quality=math.sqrt(2.0) / 2.0):
         # Call the filter setup function:
         self.set_params(dt, freq_hz, gain, quality)
@@ -13,84 +78,102 @@ class Filter2ndOrder:
         if dt <= 0:
             raise ValueError("Value of 'dt' must be greater than 0.")
 
-        self._dt = dt
-
-        zeta = 1.0 / (2 * q)
-        w0   = freq_hz * 2 * math.pi
-        D    = zeta ** 2 - 1
-        p    = (-w0 * (zeta + cmath.sqrt(D)), -w0 * (zeta - cmath.sqrt(D)))
-
-        self._s_poles = np.array(p,  dtype=np.complex64)
-        self._s_zeros = np.array([], dtype=np.complex64)
-        self._s_n_poles = len(p)
-        self._s_n_zeros = 0
-        self._s_gain = gain * w0 ** 2
-
-        self._z_poles = []
-        self._z_zeros = []
-        self._z_n_poles = 0
-        self._z_n_zeros = 0
-        self._z_gain = 0
-        
-        self._c2d()
-
-        self._generate_diff_eqn()
-
-        self._zi = np.array([], dtype=np.float32)
-
-        self._cx = np.array([0.0, 0.0], dtype=np.float32)
-        self._cy = np.array([0.0, 0.0], dtype=np.float32)
-        self._cxn = self._B[2] / self._A[2]
-        self._cx[0] = self._B[1] / self._A[2]
-        self._cx[1] = self._B[0] / self._A[2]
-        self._cy[0] = self._A[1] / self._A[2]
-        self._cy[1] = self._A[0] / self._A[2]
-
-    def filter_val(self, val):
-        if not self._zi.size:
+        key = (dt, freq_hz, gain, q)
+        design = self._designs.get(key)
+        if design is None:
+            design = self._designs[key] = _FilterDesign(dt, freq_hz, gain, q)
+        self._design = design
+
+        # The state is initialized from the first value filtered
+        self._initialized = False
+        self._zi0 = self._zi1 = 0.0
+
+    @property
+    def dt(self):
+        return self._design.dt
+
+    @property
+    def A(self):
+        ''' The denominator of the filter's discrete transfer function, as a np.poly1d '''
+        return self._design.A
+
+    @property
+    def B(self):
+        ''' The numerator of the filter's discrete transfer function, as a np.poly1d '''
+        return self._design.B
+
+    def filter_val(self, val, steps=1):
+        # Filter 'val' for 'steps' samples and return the last output
+        if not self._initialized:
             self._init(val)
 
-        out = val * self._cxn + self._zi[0]
-        self._zi[0] = -out * self._cy[0] + val * self._cx[0] + self._zi[1]
-        self._zi[1] = -out * self._cy[1] + val * self._cx[1]
+        d = self._design
+        if steps == 1:
+            out = val * d.cxn + self._zi0
+            self._zi0 = -out * d.cy0 + val * d.cx0 + self._zi1
+            self._zi1 = -out * d.cy1 + val * d.cx1
+        else:
+            (F, H, C, k) = d.held(steps)
+            (zi0, zi1) = (self._zi0, self._zi1)
+            out = C[0] * zi0 + C[1] * zi1 + k * val
+            self._zi0 = F[0][0] * zi0 + F[0][1] * zi1 + H[0] * val
+            self._zi1 = F[1][0] * zi0 + F[1][1] * zi1 + H[1] * val
 
         return out
 
-    def _c2d(self):
-        samp_freq = 1 / self._dt
-        sample_time = self._dt
-
-        for z in self._s_zeros:
-            zero = z * sample_time / 2
-            self._z_zeros.append((1 + zero) / (1 - zero))
-        self._z_n_zeros = self._s_n_zeros
+    def get_state(self):
+        # The filter's internal state as (initialized, zi[0], zi[1])
+        if not self._initialized:
+            return (0, 0.0, 0.0)
+        return (1, self._zi0, self._zi1)
 
-        for p in self._s_poles:
-            pole = p * sample_time / 2
-            self._z_poles.append((1 + pole) / (1 - pole))
-        self._z_n_poles = self._s_n_poles
+    def set_state(self, state):
+        (initialized, zi0, zi1) = state
+        self._initialized = bool(initialized)
+        (self._zi0, self._zi1) = (zi0, zi1) if initialized else (0.0, 0.0)
 
-        g = complex(1, 0)
-        for z in self._s_zeros:
-            g *= 2 * samp_freq - z
-        for p in self._s_poles:
-            g /= 2 * samp_freq - p
+    def _init(self, val):
+        d = self._design
+        y = val * (d.cxn + d.cx0 + d.cx1) / (1.0 + d.cy0 + d.cy1)
+        self._zi1 = -y * d.cy1 + val * d.cx1
+        self._zi0 = -y * d.cy0 + val * d.cx0 + self._zi1
+        self._initialized = True
+
+
+class VecFilter2ndOrder:
+    '''
+    Runs the filter designed by a Filter2ndOrder on an array of independent signals at
+    once.  Each element is initialized from its first value, like Filter2ndOrder is.
+    '''
+    def __init__(self, filt, shape):
+        d = filt._design
+        self._cxn = d.cxn
+        self._cx = (d.cx0, d.cx1)
+        self._cy = (d.cy0, d.cy1)
+        self._initialized = np.zeros(shape, dtype=bool)
+        self._zi = np.zeros((2,) + self._initialized.shape)
+
+    def reset(self, mask=Ellipsis):
+        # The selected elements are initialized again from their next value
+        self._initialized[mask] = False
 
-        self._z_gain = (g * self._s_gain).real
+    def filter_val(self, val):
+        new = ~self._initialized
+        if new.any():
+            self._init(val, new)
 
-        while self._z_n_zeros < self._z_n_poles:
-            self._z_zeros.append(complex(-1, 0))
-            self._z_n_zeros += 1
+        out = val * self._cxn + self._zi[0]
+        self._zi[0] = -out * self._cy[0] + val * self._cx[0] + self._zi[1]
+        self._zi[1] = -out * self._cy[1] + val * self._cx[1]
 
-    def _generate_diff_eqn(self):
-        self._B = self._z_gain * np.poly1d(self._z_zeros, True)
-        self._A = np.poly1d(self._z_poles, True)
+        return out
 
-    def _init(self, val):
+    def _init(self, val, mask):
+        val = val[mask]
         y = val * (self._cxn + self._cx[0] + self._cx[1]) / (1.0 + self._cy[0] + self._cy[1])
-        self._zi = np.array([0, 0], dtype=np.float32)
-        self._zi[1] = -y * self._cy[1] + val * self._cx[1]
-        self._zi[0] = -y * self._cy[0] + val * self._cx[0] + self._zi[1]
+        self._zi[1][mask] = -y * self._cy[1] + val * self._cx[1]
+        self._zi[0][mask] = -y * self._cy[0] + val * self._cx[0] + self._zi[1][mask]
+        self._initialized[mask] = True
 
 
 def rot2d(yaw, p):
@@ -126,3 +209,17 @@ def slew_rate_limit(cur, des, limit, dt):
         return cur
     change = saturate((des - cur) / dt, -limit, limit) * dt
     return cur + change
+
+
+# Vectorized versions of the functions above, for NumPy arrays of values
+def vec_deadband(val, a, b):
+    min_val = min(a, b)
+    max_val = max(a, b)
+    return np.where(val < min_val, val - min_val, np.where(val > max_val, val - max_val, 0.0))
+
+
+def vec_slew_rate_limit(cur, des, limit, dt):
+    if dt <= 0:
+        return cur
+    change = np.clip((des - cur) / dt, -limit, limit) * dt
+    return np.where(limit < 0, cur, cur + change)